@@ -11,12 +11,12 @@ import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 from langchain_community.embeddings import OllamaEmbeddings
-from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
+from rag_backend import QdrantRetrieverPool, cache_metrics
+from reranker import load_reranker
+from rag_chain import build_rag_chain
+from context_builder import ContextBuilder
+from embedding_cache import QueryEmbeddingCache
 
 # Configure logging
 logging.basicConfig(
@@ -54,7 +54,9 @@ class MachineBreakdownRAG:
         # Create LangChain interface
         self.llm = HuggingFacePipeline(pipeline=pipe)
         
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
+        self.embeddings = QueryEmbeddingCache(
+            OllamaEmbeddings(model="nomic-embed-text"), "nomic-embed-text", max_entries=2048
+        )
         self.collection_names = {
             'master': 'machine_data_master',
             '1150': 'machine_data_1150',
@@ -63,88 +65,29 @@ class MachineBreakdownRAG:
             '1300': 'machine_data_1300'
         }
         self.user_role = user_role
-        self.vector_store = self._initialize_vector_store()
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 50}
+        self.reranker = load_reranker(top_n=20, latency_budget_ms=300)
+        self.retriever_pool = QdrantRetrieverPool(
+            self.collection_names, self.embeddings, k=50, reranker=self.reranker
         )
+        self.vector_store, self.retriever = self.retriever_pool.get(self.user_role)
         self.conversation_history = []
+        # Prompt budget, leaving room for the 2048-token answer from the local 8B model
+        self.context_builder = ContextBuilder(max_tokens=3500)
+        # Prompt, model and parser are fixed; only the inputs change between requests
+        self.rag_chain = self._build_rag_chain()
         
-    def _initialize_vector_store(self):
-        """Initialize connection to Qdrant vector store"""
-        client = QdrantClient(
-            host="localhost",
-            port=6333,
-            timeout=30.0
-        )
-        collection_name = self.collection_names.get(self.user_role, 'machine_data_master')
-        return QdrantVectorStore(
-            client=client,
-            collection_name=collection_name,
-            embedding=self.embeddings
-        )
-    
-    def switch_collection(self, new_role: str):
+    async def switch_collection(self, new_role: str):
         """Switch to a different collection based on user role"""
+        if new_role == self.user_role:
+            return
         if new_role in self.collection_names:
+            self.vector_store, self.retriever = await self.retriever_pool.aget(new_role)
             self.user_role = new_role
-            self.vector_store = self._initialize_vector_store()
-            self.retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 50}
-            )
             logger.info(f"Switched to collection for {new_role}")
         else:
             logger.warning(f"Invalid role: {new_role}. Keeping current collection.")
     
-    def verify_connection(self):
-        """Verify connection to Qdrant"""
-        try:
-            self.vector_store.client.get_collections()
-            return True, "Connected to Qdrant and vector store is ready"
-        except Exception as e:
-            return False, f"Connection error: {str(e)}"
-        
-    def _format_docs(self, docs: List[Dict]) -> str:
-        """Format retrieved documents for context with better structure"""
-        formatted = []
-        for doc in docs:
-            formatted.append(
-                f"### Machine Breakdown Record\n"
-                f"**Machine ID:** {doc.metadata.get('machine_id', 'Unknown')}\n"
-                f"**Machine Name:** {doc.metadata.get('machine_name', 'Unknown')}\n"
-                f"**SAP Code:** {doc.metadata.get('sap_code', 'Unknown')}\n"
-                f"**Plant:** {doc.metadata.get('plant', 'Unknown')}\n"
-                f"**Shop:** {doc.metadata.get('shop', 'Unknown')}\n"
-                f"**Module:** {doc.metadata.get('module', 'Unknown')}\n"
-                f"**Line:** {doc.metadata.get('line', 'Unknown')}\n"
-                f"**Problem Type:** {doc.metadata.get('problem_type', 'Unknown')}\n"
-                f"**Service Type:** {doc.metadata.get('service_type', 'Unknown')}\n"
-                f"**Shift:** {doc.metadata.get('shift', 'Unknown')}\n"
-                f"**Duration (Minutes):** {doc.metadata.get('duration_minutes', 0)} minutes\n"
-                f"**Duration (Hours):** {doc.metadata.get('duration_hours', 0.0)} hours\n"
-                f"**Start Time:** {doc.metadata.get('start_time', 'Unknown')}\n"
-                f"**End Time:** {doc.metadata.get('end_time', 'Unknown')}\n"
-                f"**Problem:** {doc.metadata.get('problem', 'Unknown')}\n"
-                f"**Solution:** {doc.metadata.get('solution', 'No solution provided')}\n"
-                f"**Details:** {doc.metadata.get('details', 'No additional details')}\n"
-                f"**Closure Reason:** {doc.metadata.get('closure_reason', 'Unknown')}\n"
-                f"**Breakdown Type:** {doc.metadata.get('breakdown_type', 'Unknown')}\n"
-                f"**SAP Status:** {doc.metadata.get('sap_status', 'Unknown')}\n"
-                f"**Sub Group:** {doc.metadata.get('sub_group', 'Unknown')}\n"
-                f"**Phenomena:** {doc.metadata.get('phenomena', 'Unknown')}\n"
-                f"**LOTO:** {doc.metadata.get('loto', 'Unknown')}\n"
-                f"**Vendor:** {doc.metadata.get('vendor', 'Unknown')}\n"
-                f"**Material:** {doc.metadata.get('material', 'Unknown')}\n"
-                f"**Unique ID:** {doc.metadata.get('unique_id', 'Unknown')}\n"
-                f"**Type ID:** {doc.metadata.get('type_id', 'Unknown')}\n"
-                f"**Relevance Score:** {doc.metadata.get('relevance_score', 'N/A')}\n"
-                f"**Human Readable Text:** {doc.metadata.get('human_readable_text', 'N/A')}\n"
-                f"**Full Text:** {doc.metadata.get('full_text', 'N/A')}\n"
-            )
-        return "\n\n".join(formatted)
-    
-    def _get_rag_chain(self):
+    def _build_rag_chain(self):
         """Create the RAG chain with enhanced prompt for better formatting"""
         template = """You are an expert technician assistant analyzing machine breakdown data. 
         Provide comprehensive, well-structured answers using Markdown formatting with these sections:
@@ -175,23 +118,35 @@ class MachineBreakdownRAG:
         
         **Answer:**"""
         
-        prompt = ChatPromptTemplate.from_template(template)
-        
-        return (
-            {
-                "context": self.retriever | self._format_docs,
-                "question": RunnablePassthrough(),
-                "history": lambda _: "\n".join(self.conversation_history[-3:])  # Last 3 exchanges
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        return build_rag_chain(template, self.llm, self.context_builder.build, reserve_prompt=True)
+
+    def _chain_input(self, question: str) -> Dict[str, Any]:
+        """Current plant retriever plus the last three history lines for one chain call"""
+        return {
+            "question": question,
+            "history": "\n".join(self.conversation_history[-3:]),
+            "retriever": self.retriever
+        }
     
     def query(self, question: str) -> str:
         """Query the RAG system with a question and maintain conversation history"""
-        rag_chain = self._get_rag_chain()
-        response = rag_chain.invoke(question)
+        chain_input = self._chain_input(question)
+        response = self.rag_chain.invoke(chain_input)
+        
+        # Update conversation history
+        self.conversation_history.append(f"User: {question}")
+        self.conversation_history.append(f"Assistant: {response}")
+        
+        # Keep history manageable
+        if len(self.conversation_history) > 6:  # 3 exchanges
+            self.conversation_history = self.conversation_history[-6:]
+            
+        return response
+
+    async def aquery(self, question: str) -> str:
+        """Async query; the local pipeline's generation runs in LangChain's thread pool"""
+        chain_input = self._chain_input(question)
+        response = await self.rag_chain.ainvoke(chain_input)
         
         # Update conversation history
         self.conversation_history.append(f"User: {question}")
@@ -247,6 +202,7 @@ class ExampleResponse(BaseModel):
 class HealthResponse(BaseModel):
     status: str
     message: str
+    cache: Optional[Dict[str, Dict[str, float]]] = None
 
 class LoginResponse(BaseModel):
     status: str
@@ -275,8 +231,8 @@ def verify_user(credentials: HTTPBasicCredentials = Depends(security)):
 @app.get("/api/health")
 async def health_check() -> HealthResponse:
     """Health check endpoint"""
-    status, message = rag_system.verify_connection()
-    return HealthResponse(status="ok" if status else "error", message=message)
+    status, message = await rag_system.retriever_pool.verify_connection()
+    return HealthResponse(status="ok" if status else "error", message=message, cache=cache_metrics(rag_system.embeddings))
 
 @app.get("/api/examples")
 async def get_example_questions() -> ExampleResponse:
@@ -287,7 +243,7 @@ async def get_example_questions() -> ExampleResponse:
 async def login(user: Dict = Depends(verify_user)) -> LoginResponse:
     """Login endpoint"""
     try:
-        rag_system.switch_collection(user["plant"])
+        await rag_system.switch_collection(user["plant"])
         return LoginResponse(
             status="success",
             plant=user["plant"],
@@ -304,8 +260,8 @@ async def process_query(
 ) -> QueryResponse:
     """Process chat query"""
     try:
-        rag_system.switch_collection(user["plant"])
-        answer = rag_system.query(query.question)
+        await rag_system.switch_collection(user["plant"])
+        answer = await rag_system.aquery(query.question)
         return QueryResponse(answer=answer)
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
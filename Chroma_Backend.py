@@ -1,8 +1,9 @@
+import asyncio
 import logging
 import torch
 import os
 from datetime import datetime
-from typing import List, Dict
+from typing import Any, List, Dict, Optional
 import httpx
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,10 +14,11 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 from langchain_community.llms import HuggingFacePipeline
 from transformers import pipeline
 from langchain_community.embeddings import OllamaEmbeddings
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_community.vectorstores import Chroma
+from rag_chain import build_rag_chain
+from rag_backend import RetrieverPool, cache_metrics
+from reranker import load_reranker
+from embedding_cache import QueryEmbeddingCache
 
 
 # Configure logging
@@ -26,6 +28,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class ChromaRetrieverPool(RetrieverPool):
+    """RetrieverPool over the per-plant Chroma stores persisted under chroma_db/"""
+
+    def __init__(self, collection_names: Dict[str, str], embeddings, k: int, reranker=None):
+        self.embeddings = embeddings
+        super().__init__(collection_names, k, reranker)
+
+    def _open_store(self, collection_name: str) -> Chroma:
+        # Create or load Chroma collection
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=os.path.join("chroma_db", collection_name)
+        )
+
+    def _base_retriever(self, vector_store: Chroma, k: int):
+        return vector_store.as_retriever(search_type="similarity", search_kwargs={"k": k})
+
 class MachineBreakdownRAG:
     def __init__(self, user_role: str = 'master'):
         model_path = r"C:/Users/Jeyavarman Murugan/.cache/huggingface/hub/models--Qwen--Qwen3-1.7B/snapshots/70d244cc86ccca08cf5af4e1e306ecf908b1ad5e"
@@ -51,7 +71,9 @@ class MachineBreakdownRAG:
 
         self.llm = HuggingFacePipeline(pipeline=pipe)
         
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
+        self.embeddings = QueryEmbeddingCache(
+            OllamaEmbeddings(model="nomic-embed-text"), "nomic-embed-text", max_entries=2048
+        )
         self.collection_names = {
             'Master': 'machine_data_master',
             '1150': 'machine_data_1150',
@@ -60,33 +82,19 @@ class MachineBreakdownRAG:
             '1300': 'machine_data_1300'
         }
         self.user_role = user_role
-        self.vector_store = self._initialize_vector_store()
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 5}  
-        )
+        self.reranker = load_reranker(top_n=5, latency_budget_ms=300)
+        self.retriever_pool = ChromaRetrieverPool(self.collection_names, self.embeddings, k=5, reranker=self.reranker)
+        self.vector_store, self.retriever = self.retriever_pool.get(self.user_role)
         self.conversation_history = []
+        # Built at startup; the per-plant Chroma retriever is an input, not part of the chain
+        self.rag_chain = self._build_rag_chain()
         
-    def _initialize_vector_store(self):
-        collection_name = self.collection_names.get(self.user_role, 'machine_data_master')
-        persist_directory = os.path.join("chroma_db", collection_name)
-        
-        # Create or load Chroma collection
-        vector_store = Chroma(
-            collection_name=collection_name,
-            embedding_function=self.embeddings,
-            persist_directory=persist_directory
-        )
-        return vector_store
-    
-    def switch_collection(self, new_role: str):
+    async def switch_collection(self, new_role: str):
+        if new_role == self.user_role:
+            return
         if new_role in self.collection_names:
+            self.vector_store, self.retriever = await self.retriever_pool.aget(new_role)
             self.user_role = new_role
-            self.vector_store = self._initialize_vector_store()
-            self.retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}
-            )
             logger.info(f"Switched to collection for {new_role}")
         else:
             logger.warning(f"Invalid role: {new_role}. Keeping current collection.")
@@ -120,7 +128,7 @@ class MachineBreakdownRAG:
             )
         return "\n\n".join(formatted)
     
-    def _get_rag_chain(self):
+    def _build_rag_chain(self):
         template = """
         Respond ONLY in this exact format with these sections (include the section headers):
 
@@ -151,28 +159,49 @@ class MachineBreakdownRAG:
         Provide ONLY the formatted response, no additional commentary:
         """
         
-        prompt = ChatPromptTemplate.from_template(template)
-        
-        return (
-            {
-                "context": self.retriever | self._format_docs,
-                "question": RunnablePassthrough(),
-                # Only include the last few user questions — no assistant answers
-                "history": lambda _: "\n".join(
-                    [h for h in self.conversation_history[-6:] if h.startswith("User:")]
-                ),
-                "time": lambda _: datetime.now().strftime("%I:%M %p")
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
+        return build_rag_chain(
+            template,
+            self.llm,
+            self._format_docs,
+            time=lambda _: datetime.now().strftime("%I:%M %p")
         )
 
+    def _chain_input(self, question: str) -> Dict[str, Any]:
+        """Chain input whose history holds only the user's recent questions"""
+        return {
+            "question": question,
+            # Only include the last few user questions — no assistant answers
+            "history": "\n".join(
+                [h for h in self.conversation_history[-6:] if h.startswith("User:")]
+            ),
+            "retriever": self.retriever
+        }
+
     
     def query(self, question: str) -> str:
-        rag_chain = self._get_rag_chain()
+        chain_input = self._chain_input(question)
+        try:
+            response = self.rag_chain.invoke(chain_input)
+            
+            # Simple deduplication check
+            if "Assistant:" in response:
+                response = response.split("Assistant:")[-1].strip()
+            
+            self.conversation_history.append(f"User: {question}")
+            
+            if len(self.conversation_history) > 6:
+                self.conversation_history = self.conversation_history[-6:]
+            
+            return response.strip()
+        except Exception as e:
+            logger.error(f"Error in query processing: {str(e)}")
+            return f"Error processing your request: {str(e)}"
+
+    async def aquery(self, question: str) -> str:
+        """Async query; Chroma search and local generation run in LangChain's thread pool"""
+        chain_input = self._chain_input(question)
         try:
-            response = rag_chain.invoke(question)
+            response = await self.rag_chain.ainvoke(chain_input)
             
             # Simple deduplication check
             if "Assistant:" in response:
@@ -232,6 +261,7 @@ class ExampleResponse(BaseModel):
 class HealthResponse(BaseModel):
     status: str
     message: str
+    cache: Optional[Dict[str, Dict[str, float]]] = None
 
 class LoginResponse(BaseModel):
     status: str
@@ -259,8 +289,9 @@ def verify_user(credentials: HTTPBasicCredentials = Depends(security)):
 
 @app.get("/api/health")
 async def health_check() -> HealthResponse:
-    status, message = rag_system.verify_connection()
-    return HealthResponse(status="ok" if status else "error", message=message)
+    # Chroma reads its collection from disk
+    status, message = await asyncio.to_thread(rag_system.verify_connection)
+    return HealthResponse(status="ok" if status else "error", message=message, cache=cache_metrics(rag_system.embeddings))
 
 @app.get("/api/examples")
 async def get_example_questions() -> ExampleResponse:
@@ -271,7 +302,7 @@ async def get_example_questions() -> ExampleResponse:
 async def login(user: Dict = Depends(verify_user)) -> LoginResponse:
     """Login endpoint"""
     try:
-        rag_system.switch_collection(user["plant"])
+        await rag_system.switch_collection(user["plant"])
         return LoginResponse(
             status="success",
             plant=user["plant"],
@@ -288,8 +319,8 @@ async def process_query(
 ) -> QueryResponse:
     """Process chat query"""
     try:
-        rag_system.switch_collection(user["plant"])
-        answer = rag_system.query(query.question)
+        await rag_system.switch_collection(user["plant"])
+        answer = await rag_system.aquery(query.question)
         return QueryResponse(answer=answer)
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
@@ -7,12 +7,17 @@ from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 import logging
-from typing import List, Any, Optional, Dict
+from typing import List, Any, Optional, Dict, Iterable, Iterator
 from datetime import datetime
 import pyodbc
 from sqlalchemy import create_engine
 import urllib.parse
 import re
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from checkpoint_store import CheckpointStore
+from delta_extraction import BreakdownDeltaSource
+from ingestion import FRAME_DEFAULTS, TEXT_COLUMNS, BreakdownIngestion, point_id
+from sparse_index import SPARSE_VECTOR_NAME, BM25SparseEncoder, has_sparse_index, sparse_vectors_config
 
 # Configure logging
 logging.basicConfig(
@@ -21,7 +26,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class DataProcessor:
+class DataProcessor(BreakdownIngestion):
+    source_table = 'MachineBreakdowns'
+    # PlantName is normalized to a plant code, so it is cleaned with the text columns
+    text_columns = TEXT_COLUMNS + ['PlantName']
+    frame_defaults = {**FRAME_DEFAULTS, 'PlantName': 'UNKNOWN'}
+
     def __init__(self, base_path: str = None):
         # SQL Server connection parameters
         self.server = 'JEY_JARVIS'
@@ -34,7 +44,16 @@ class DataProcessor:
             '1250': 'machine_data_1250',
             '1300': 'machine_data_1300'
         }
-        
+        self.embedding_model = 'BAAI/bge-m3'
+        self.batch_size = 256  # Unique documents embedded per call
+        self.streaming = True  # Stream MachineBreakdowns in chunks instead of one DataFrame
+        self.read_chunk_size = 5000  # Rows fetched from SQL Server per chunk
+        self.use_embedding_cache = True
+        self.embedding_cache_dir = 'embedding_cache'
+        self.progress_db = 'embedding_qdrant_progress.db'  # Delta baseline for MachineBreakdowns
+        self.collection_versions_db = 'collection_versions.db'  # Read by the chat backends' answer caches
+        self.sparse_encoder = BM25SparseEncoder()  # Lexical index for SAP codes, IDs and error phrases
+        self._sparse_collections: set = set()
         
         self.plant_aliases = {
             'VARNAVASI': '1150',
@@ -46,6 +65,10 @@ class DataProcessor:
             '1250': '1250',
             '1300': '1300'
         }
+        # Code -> display name, built once instead of on every lookup
+        self.plant_display_names = {v: k for k, v in self.plant_aliases.items() if not k.isdigit()}
+        # Raw PlantName spelling -> code; there are only a few dozen distinct spellings
+        self._plant_code_cache: Dict[str, str] = {}
         
     def _normalize_plant_name(self, plant_input: Any) -> str:
         if pd.isna(plant_input) or str(plant_input).strip() == '':
@@ -87,8 +110,22 @@ class DataProcessor:
         """
         Get the display name for a plant code.
         """
-        reverse_mapping = {v: k for k, v in self.plant_aliases.items() if not k.isdigit()}
-        return reverse_mapping.get(plant_code, plant_code)
+        return self.plant_display_names.get(plant_code, plant_code)
+
+    def _plant_code(self, plant_input: Any) -> str:
+        """Memoized _normalize_plant_name"""
+        if pd.isna(plant_input):
+            return 'UNKNOWN'
+        plant_code = self._plant_code_cache.get(plant_input)
+        if plant_code is None:
+            plant_code = self._normalize_plant_name(plant_input)
+            self._plant_code_cache[plant_input] = plant_code
+        return plant_code
+
+    def _normalize_plant_column(self, col: pd.Series) -> pd.Series:
+        """Normalize each distinct PlantName once and map the codes back onto the column"""
+        codes = {value: self._plant_code(value) for value in col.dropna().unique()}
+        return col.map(codes).fillna('UNKNOWN')
 
     def _get_sql_connection(self):
         """Establish connection to SQL Server using Windows Authentication"""
@@ -172,7 +209,7 @@ class DataProcessor:
         end_dt = self._format_datetime(row['EndDate'], row['EndTime'])
         
         # Get plant display name for human-readable text
-        plant_code = self._normalize_plant_name(row.get('PlantName', 'UNKNOWN'))
+        plant_code = row.get('PlantCode') or self._plant_code(row.get('PlantName', 'UNKNOWN'))
         plant_display = self._get_plant_display_name(plant_code)
         
         text_parts = [
@@ -226,63 +263,12 @@ class DataProcessor:
         # Join all parts and clean up empty lines
         return " ".join(text_parts).replace(" .", ".").replace(" ,", ",")
 
-    def load_data(self) -> pd.DataFrame:
-        logger.info("🔄 Loading data from SQL Server...")
-        try:
-            # Using SQLAlchemy engine for pandas
-            engine = self._get_sqlalchemy_engine()
-            
-            # Query to get all data from the table
-            query = "SELECT * FROM MachineBreakdowns"
-            
-            # Read data into DataFrame
-            df = pd.read_sql(query, engine)
-            
-            # Clean text columns
-            text_columns = ['MachineName', 'ProblemType', 'Reason', 'ActualReason', 'details',
-                          'ShopName', 'ModuleName', 'LineName', 'Servicetype', 'ClosureReason',
-                          'Breakdowntype', 'SubGroup', 'Phenomena', 'Loto', 'Vendor', 'Material',
-                          'PlantName']  
-            
-            for col in text_columns:
-                if col in df.columns:
-                    df[col] = df[col].apply(self._clean_text)
-
-            # Fill missing values with appropriate defaults
-            df = df.fillna({
-                'SapMachnCode': 'UNKNOWN',
-                'MachineName': 'UNKNOWN_MACHINE',
-                'details': '',
-                'ActualReason': 'NO SOLUTION PROVIDED',
-                'Reason': 'NO PROBLEM PROVIDED',
-                'Minutes': 0,
-                'Hours': 0,
-                'ProblemType': 'UNKNOWN',
-                'ClosureReason': 'UNKNOWN',
-                'Vendor': '',
-                'Material': '',
-                'Loto': '',
-                'StartTime': '',
-                'EndTime': '',
-                'PlantName': 'UNKNOWN'
-            })
-
-            # Convert numeric fields
-            df['Minutes'] = pd.to_numeric(df['Minutes'], errors='coerce').fillna(0).astype(int)
-            df['Hours'] = pd.to_numeric(df['Hours'], errors='coerce').fillna(0).astype(float)
-
-            return df
-
-        except Exception as e:
-            logger.error(f"Error loading data from SQL Server: {e}")
-            raise
-
     def create_documents(self, df: pd.DataFrame) -> Dict[str, List[Document]]:
         """Create documents grouped by plant"""
         logger.info("📝 Creating documents...")
         
         # Normalize plant names to codes
-        df['PlantCode'] = df['PlantName'].apply(self._normalize_plant_name)
+        df['PlantCode'] = self._normalize_plant_column(df['PlantName'])
         
         unique_plants = df['PlantCode'].unique()
         logger.info(f"Unique plant codes after normalization: {unique_plants}")
@@ -379,7 +365,7 @@ class DataProcessor:
                     "loto": row['Loto'],
                     "vendor": row['Vendor'],
                     "material": row['Material'],
-                    "unique_id": str(row.get('Unique_id', '')),
+                    "unique_id": str(row.get('Unique_ID_No', row.get('Unique_id', ''))),
                     "type_id": str(row.get('Type_id', '')),
                     "human_readable_text": human_readable_text,
                     "full_text": structured_text
@@ -418,16 +404,23 @@ class DataProcessor:
 
         return documents
 
-    def create_vector_stores(self, documents: Dict[str, List[Document]]):
-        """Create vector stores for all collections"""
+    def create_vector_stores(self, documents: Dict[str, List[Document]]) -> set:
+        """Create vector stores, embedding each unique document once for all its collections"""
+        return self.create_vector_stores_streaming([documents])
+
+    def create_vector_stores_streaming(self, document_chunks: Iterable[Dict[str, List[Document]]]) -> set:
+        """Embed and upsert document chunks as they are produced; returns collections that had failures"""
         logger.info("🧠 Creating vector stores...")
 
         # Initialize embeddings and client
         embeddings = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-m3",  
+            model_name=self.embedding_model,  
             model_kwargs={"device": "cuda"},  
             encode_kwargs={"normalize_embeddings": True}
         )
+        if self.use_embedding_cache:
+            # Unchanged texts are read back from disk instead of re-embedded
+            embeddings = CachedEmbeddings(embeddings, EmbeddingCache(self.embedding_model, self.embedding_cache_dir))
         client = QdrantClient(host="localhost", port=6333)
         
         # Vector configuration
@@ -436,48 +429,143 @@ class DataProcessor:
             distance=models.Distance.COSINE
         )
 
-        # Create/update collections
-        for collection_name, docs in documents.items():
-            try:
-                full_collection_name = self.collection_names[collection_name]
-                
-                # Check if collection exists
-                existing_collections = client.get_collections()
-                collection_exists = any(
-                    col.name == full_collection_name 
-                    for col in existing_collections.collections
-                )
-                
-                if not collection_exists:
-                    logger.info(f"Creating new collection: {full_collection_name}")
-                    client.create_collection(
-                        collection_name=full_collection_name,
-                        vectors_config=vector_config
-                    )
-                
-                logger.info(f"Updating collection: {full_collection_name} with {len(docs)} documents")
-                
-                # Create vector store and add documents
-                vector_store = QdrantVectorStore(
-                    client=client,
-                    collection_name=full_collection_name,
-                    embedding=embeddings
-                )
-                
-                # Add documents (will update existing ones with same IDs)
-                vector_store.add_documents(docs)
-                
-                logger.info(f"✅ Successfully updated {full_collection_name}")
+        existing_collections = client.get_collections()
+        existing_names = {col.name for col in existing_collections.collections}
+        ready_collections = []
+        failed_collections = set()
+
+        for documents in document_chunks:
+            # Create missing collections
+            for collection_name, docs in documents.items():
+                if collection_name in ready_collections or collection_name in failed_collections:
+                    continue
+                try:
+                    full_collection_name = self.collection_names[collection_name]
+                    if full_collection_name not in existing_names:
+                        logger.info(f"Creating new collection: {full_collection_name}")
+                        client.create_collection(
+                            collection_name=full_collection_name,
+                            vectors_config=vector_config,
+                            sparse_vectors_config=sparse_vectors_config()
+                        )
+                        existing_names.add(full_collection_name)
+                    if has_sparse_index(client, full_collection_name):
+                        self._sparse_collections.add(full_collection_name)
+                    else:
+                        logger.warning(
+                            f"{full_collection_name} has no BM25 sparse index; writing dense vectors only. "
+                            f"Drop the collection to rebuild it for hybrid search."
+                        )
+                    ready_collections.append(collection_name)
+
+                except Exception as e:
+                    failed_collections.add(collection_name)
+                    logger.error(f"❌ Failed to update collection {collection_name}: {str(e)}", exc_info=True)
+                    continue
+
+            failed_collections |= self._write_documents(embeddings, client, documents, ready_collections)
+
+        for collection_name in ready_collections:
+            if collection_name not in failed_collections:
+                logger.info(f"✅ Successfully updated {self.collection_names[collection_name]}")
+        self._bump_collection_versions(self.collection_names[name] for name in ready_collections)
+        return failed_collections
+
+    def _write_documents(self, embeddings, client: QdrantClient, documents: Dict[str, List[Document]],
+                         ready_collections: List[str]) -> set:
+        """Embed one chunk of documents and upsert them; returns collections that had failures"""
+        # The same Document goes to master and its plant, so collapse to unique documents
+        grouped: Dict[Any, tuple] = {}
+        for collection_name in ready_collections:
+            for doc in documents.get(collection_name, []):
+                key = doc.metadata.get('unique_id') or id(doc)
+                _, targets = grouped.setdefault(key, (doc, []))
+                if collection_name not in targets:
+                    targets.append(collection_name)
+        items = list(grouped.values())
+        if not items:
+            return set()
+        logger.info(
+            f"Embedding {len(items)} unique documents for "
+            f"{sum(len(targets) for _, targets in items)} collection writes"
+        )
 
+        failed_collections = set()
+        for i in range(0, len(items), self.batch_size):
+            batch = items[i:i + self.batch_size]
+            try:
+                vectors = embeddings.embed_documents([doc.page_content for doc, _ in batch])
             except Exception as e:
-                logger.error(f"❌ Failed to update collection {collection_name}: {str(e)}", exc_info=True)
+                failed_collections.update(c for _, targets in batch for c in targets)
+                logger.error(f"Failed to embed batch starting at {i}: {e}")
                 continue
 
+            points_by_collection = {}
+            for (doc, targets), vector in zip(batch, vectors):
+                sparse = self.sparse_encoder.encode_document(doc.page_content)
+                for collection_name in targets:
+                    full_collection_name = self.collection_names[collection_name]
+                    # Payload layout matches what QdrantVectorStore reads back
+                    points_by_collection.setdefault(collection_name, []).append(
+                        models.PointStruct(
+                            id=point_id(full_collection_name, doc.metadata.get('unique_id')),
+                            vector=(
+                                {"": vector, SPARSE_VECTOR_NAME: sparse}
+                                if full_collection_name in self._sparse_collections else vector
+                            ),
+                            payload={
+                                QdrantVectorStore.CONTENT_KEY: doc.page_content,
+                                QdrantVectorStore.METADATA_KEY: doc.metadata
+                            }
+                        )
+                    )
+
+            for collection_name, points in points_by_collection.items():
+                try:
+                    client.upsert(collection_name=self.collection_names[collection_name], points=points)
+                except Exception as e:
+                    failed_collections.add(collection_name)
+                    logger.error(f"Failed to upsert batch starting at {i} into {self.collection_names[collection_name]}: {e}")
+
+        return failed_collections
+
+    def _run_delta(self):
+        """Re-embed only the rows inserted or changed since the last clean run"""
+        store = CheckpointStore(self.progress_db)
+        try:
+            source = BreakdownDeltaSource(self._get_sqlalchemy_engine(), 'MachineBreakdowns', store)
+            delta = source.detect_changes()
+
+            if delta.full_reload:
+                failed_collections = self.create_vector_stores_streaming(self.iter_documents())
+            else:
+                failed_collections = set()
+                stale_ids = delta.updated_ids + delta.deleted_ids
+                if stale_ids:
+                    # Edited rows are re-embedded below; deleted rows just disappear
+                    self._delete_points(QdrantClient(host="localhost", port=6333), stale_ids)
+                if delta.changed_ids:
+                    chunks = (self._prepare_frame(chunk) for chunk in source.load_rows(delta.changed_ids))
+                    failed_collections = self.create_vector_stores_streaming(self.iter_documents(chunks))
+                else:
+                    logger.info("No new or changed breakdowns since the last run")
+
+            # Only move the baseline once everything was written; failed rows are retried next run
+            if failed_collections:
+                logger.warning(f"Writes failed for {sorted(failed_collections)}; keeping the previous delta baseline")
+            else:
+                source.commit(delta)
+        finally:
+            store.close()
+
     def run(self):
         try:
-            df = self.load_data()
-            documents = self.create_documents(df)
-            self.create_vector_stores(documents)
+            if self.streaming:
+                self._run_delta()
+            else:
+                df = self.load_data()
+                documents = self.create_documents(df)
+                self.create_vector_stores(documents)
         except Exception as e:
             logger.error(f"💥 Error in processing: {str(e)}", exc_info=True)
             raise
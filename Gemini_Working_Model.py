@@ -2,30 +2,35 @@
 import os
 import logging
 import base64
-from typing import List, Dict, Optional
+from typing import Any, AsyncIterator, List, Dict, Optional
 
 # FastAPI & Security
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, Header, status, UploadFile, File, Form
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
 # Data validation
 from pydantic import BaseModel
 
 # LangChain Core
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.messages import HumanMessage
 
 # LangChain Integrations
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_qdrant import QdrantVectorStore
+from rag_chain import build_rag_chain
+from context_builder import ContextBuilder
+from embedding_cache import QueryEmbeddingCache
 
 # Qdrant
-from qdrant_client import QdrantClient
+from rag_backend import QdrantRetrieverPool, cache_metrics, sse_event
+from reranker import load_reranker
+
+# Per-user chat state
+from rag_sessions import ChatSession, SessionStore
+from semantic_cache import CollectionVersions, SemanticAnswerCache
 
 # Configure logging
 logging.basicConfig(
@@ -50,6 +55,8 @@ class MachineBreakdownRAG:
             model_kwargs={"device": "cuda"},  
             encode_kwargs={"normalize_embeddings": True}
         )
+        # Repeated questions skip bge-m3; pass cache_dir to keep vectors across restarts
+        self.embeddings = QueryEmbeddingCache(self.embeddings, "BAAI/bge-m3", max_entries=2048)
 
         self.collection_names = {
             'Master': 'machine_data_master',
@@ -58,74 +65,30 @@ class MachineBreakdownRAG:
             '1250': 'machine_data_1250',
             '1300': 'machine_data_1300'
         }
-        self.user_role = user_role
-        self.vector_store = self._initialize_vector_store()
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 50}  
-        )
-        self.conversation_history = []
-        
-    def _initialize_vector_store(self):
-        """Initialize connection to Qdrant vector store"""
-        client = QdrantClient(
-            host="localhost",
-            port=6333,
-            timeout=30.0
+        self.retriever_k = 50
+        # Falls back to plain top-retriever_k search if the model can't load
+        self.reranker = load_reranker(top_n=20, latency_budget_ms=300)
+        self.retriever_pool = QdrantRetrieverPool(
+            self.collection_names, self.embeddings, k=self.retriever_k, reranker=self.reranker
         )
-        collection_name = self.collection_names.get(self.user_role, 'machine_data_master')
-        return QdrantVectorStore(
-            client=client,
-            collection_name=collection_name,
-            embedding=self.embeddings
+
+        # Shared, read-only after startup; per-user role and history live in ChatSession
+        self.default_role = user_role if user_role in self.collection_names else 'Master'
+        self.default_session = ChatSession('default', self.default_role)
+        # Gemini handles long prompts, but prompt size still drives latency and cost;
+        # covers template, question and history as well as the records
+        self.context_builder = ContextBuilder(max_tokens=7000)
+        # Shared by all sessions; each call brings its session's retriever and history
+        self.rag_chain = self._build_rag_chain()
+        # Near-duplicate questions per plant are answered from memory until that collection is re-ingested
+        self.answer_cache = SemanticAnswerCache(
+            similarity_threshold=0.95,
+            max_entries=500,
+            ttl_seconds=3600,
+            versions=CollectionVersions()
         )
-    
-    def switch_collection(self, new_role: str):
-        """Switch to a different collection based on user role"""
-        if new_role in self.collection_names:
-            self.user_role = new_role
-            self.vector_store = self._initialize_vector_store()
-            self.retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 50}
-            )
-            logger.info(f"Switched to collection for {new_role}")
-        else:
-            logger.warning(f"Invalid role: {new_role}. Keeping current collection.")
-    
-    def verify_connection(self):
-        """Verify connection to Qdrant"""
-        try:
-            self.vector_store.client.get_collections()
-            return True, "Connected to Qdrant and vector store is ready"
-        except Exception as e:
-            return False, f"Connection error: {str(e)}"
         
-    def _format_docs(self, docs: List[Dict]) -> str:
-        """Format retrieved documents for context with better structure"""
-        formatted = []
-        for doc in docs:
-            formatted.append(
-                f"### Machine Breakdown Record\n"
-                f"**Machine Name:** {doc.metadata.get('machine_name', 'Unknown')}\n"
-                f"**SAP Code:** {doc.metadata.get('sap_code', 'Unknown')}\n"
-                f"**Plant Code:** {doc.metadata.get('plant_code', 'Unknown')}\n"
-                f"**Plant:** {doc.metadata.get('plant_name', 'Unknown')}\n"
-                f"**Shop:** {doc.metadata.get('shop', 'Unknown')}\n"
-                f"**Module:** {doc.metadata.get('module', 'Unknown')}\n"
-                f"**Line:** {doc.metadata.get('line', 'Unknown')}\n"
-                f"**Problem Type:** {doc.metadata.get('problem_type', 'Unknown')}\n"
-                f"**Shift:** {doc.metadata.get('shift', 'Unknown')}\n"
-                f"**Duration (Minutes):** {doc.metadata.get('duration_minutes', 0)} minutes\n"
-                f"**Start Time:** {doc.metadata.get('start_time', 'Unknown')}\n"
-                f"**End Time:** {doc.metadata.get('end_time', 'Unknown')}\n"
-                f"**Problem:** {doc.metadata.get('problem', 'Unknown')}\n"
-                f"**Solution:** {doc.metadata.get('solution', 'No solution provided')}\n"
-                f"**Details:** {doc.metadata.get('details', 'No additional details')}\n"    
-            )
-        return "\n".join(formatted)
-    
-    def _get_rag_chain(self):
+    def _build_rag_chain(self):
         """Create the RAG chain with a structured, instructional prompt for Gemini"""
         template = """**Role:** You are an expert technical assistant for industrial machine maintenance and breakdown analysis.
 
@@ -181,47 +144,85 @@ class MachineBreakdownRAG:
     **ASSISTANT'S RESPONSE:**
     """
         
-        prompt = ChatPromptTemplate.from_template(template)
-        
-        return (
-            {
-                "context": self.retriever | self._format_docs,
-                "question": RunnablePassthrough(),
-                "history": lambda _: "\n".join(self.conversation_history[-3:]) if self.conversation_history else "No history"
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        return build_rag_chain(template, self.llm, self.context_builder.build, reserve_prompt=True)
+
+    def _chain_input(self, question: str, session: ChatSession, retriever) -> Dict[str, Any]:
+        """Per-call input for the compiled chain: the session's plant retriever and history"""
+        return {
+            "question": question,
+            "history": session.recent_history(),
+            "retriever": retriever
+        }
     
-    def query(self, question: str) -> str:
-        """Query the RAG system with a question and maintain conversation history"""
+    def query(self, question: str, session: Optional[ChatSession] = None) -> str:
+        """Query the RAG system with a question and maintain the session's conversation history"""
+        session = session or self.default_session
+        collection = self.collection_names[session.role]
         try:
-            rag_chain = self._get_rag_chain()
-            response = rag_chain.invoke(question)
-            
-            # Update conversation history
-            self.conversation_history.append(f"User: {question}")
-            self.conversation_history.append(f"Assistant: {response}")
-            
-            # Keep history manageable
-            if len(self.conversation_history) > 6:
-                self.conversation_history = self.conversation_history[-6:]
-                
+            chain_input = self._chain_input(question, session, self.retriever_pool.get(session.role)[1])
+            question_vector = self.embeddings.embed_query(question)
+            chain_input["question_vector"] = question_vector
+            response = self.answer_cache.lookup(collection, question_vector, chain_input["history"])
+            if response is None:
+                response = self.rag_chain.invoke(chain_input)
+                self.answer_cache.store(collection, question, question_vector, response, chain_input["history"])
+            session.add_turn(question, response)
             return response
             
         except Exception as e:
             logger.error(f"Error in query processing: {str(e)}")
             return f"I encountered an error while processing your request. Please try again. Error: {str(e)}"
-    
-    def process_image_with_text(self, image_data: str, text_query: Optional[str] = None) -> str:
-        """
-        Process an image with optional text query using Gemini's multimodal capabilities
-        Focuses only on machine and mechanical related images with structured response
-        """
+
+    async def aquery(self, question: str, session: Optional[ChatSession] = None) -> str:
+        """Async query: embedding, Qdrant search and the Gemini call are all awaited"""
+        session = session or self.default_session
+        collection = self.collection_names[session.role]
         try:
-            # Create a comprehensive prompt for image analysis with structured output
-            image_prompt = """**Role:** You are an expert technical assistant for industrial machine maintenance and breakdown analysis.
+            _, retriever = await self.retriever_pool.aget(session.role)
+            chain_input = self._chain_input(question, session, retriever)
+            question_vector = await self.embeddings.aembed_query(question)
+            chain_input["question_vector"] = question_vector
+            response = await self.answer_cache.alookup(collection, question_vector, chain_input["history"])
+            if response is None:
+                response = await self.rag_chain.ainvoke(chain_input)
+                await self.answer_cache.astore(collection, question, question_vector, response, chain_input["history"])
+            session.add_turn(question, response)
+            return response
+
+        except Exception as e:
+            logger.error(f"Error in query processing: {str(e)}")
+            return f"I encountered an error while processing your request. Please try again. Error: {str(e)}"
+
+    def astream_query(self, question: str, session: Optional[ChatSession] = None) -> AsyncIterator[str]:
+        """Stream the answer as it is generated; history is updated once the stream completes"""
+        session = session or self.default_session
+        collection = self.collection_names[session.role]
+
+        async def stream():
+            _, retriever = await self.retriever_pool.aget(session.role)
+            chain_input = self._chain_input(question, session, retriever)
+            question_vector = await self.embeddings.aembed_query(question)
+            chain_input["question_vector"] = question_vector
+            cached = await self.answer_cache.alookup(collection, question_vector, chain_input["history"])
+            if cached is not None:
+                session.add_turn(question, cached)
+                yield cached
+                return
+
+            chunks = []
+            async for chunk in self.rag_chain.astream(chain_input):
+                chunks.append(chunk)
+                yield chunk
+            response = "".join(chunks)
+            await self.answer_cache.astore(collection, question, question_vector, response, chain_input["history"])
+            session.add_turn(question, response)
+
+        return stream()
+    
+    def _build_image_message(self, image_data: str, text_query: Optional[str] = None) -> HumanMessage:
+        """Build the multimodal Gemini message for an image analysis request"""
+        # Create a comprehensive prompt for image analysis with structured output
+        image_prompt = """**Role:** You are an expert technical assistant for industrial machine maintenance and breakdown analysis.
 
         **Objective:** Analyze the provided industrial/machine image and provide comprehensive technical insights.
 
@@ -302,28 +303,55 @@ class MachineBreakdownRAG:
         - Do not hallucinate information - only report what is visible
         """
 
-            if text_query:
-                image_prompt = f"USER QUERY: {text_query}\n\n{image_prompt}"
+        if text_query:
+            image_prompt = f"USER QUERY: {text_query}\n\n{image_prompt}"
 
-            # Create a multimodal message
-            message = HumanMessage(
-                content=[
-                    {"type": "text", "text": image_prompt},
-                    {"type": "image_url", "image_url": {"url": image_data}},
-                ]
-            )
+        # Create a multimodal message
+        return HumanMessage(
+            content=[
+                {"type": "text", "text": image_prompt},
+                {"type": "image_url", "image_url": {"url": image_data}},
+            ]
+        )
+
+    def process_image_with_text(self, image_data: str, text_query: Optional[str] = None,
+                                session: Optional[ChatSession] = None) -> str:
+        """
+        Process an image with optional text query using Gemini's multimodal capabilities
+        Focuses only on machine and mechanical related images with structured response
+        """
+        try:
+            message = self._build_image_message(image_data, text_query)
 
             # Use the LLM directly for image processing
             response = self.llm.invoke([message])
 
             # Update conversation history
-            history_entry = f"User: [Image analysis request] {text_query if text_query else ''}"
-            self.conversation_history.append(history_entry)
-            self.conversation_history.append(f"Assistant: {response.content}")
+            (session or self.default_session).add_turn(
+                f"[Image analysis request] {text_query if text_query else ''}",
+                response.content
+            )
+
+            return response.content
 
-            # Keep history manageable
-            if len(self.conversation_history) > 6:
-                self.conversation_history = self.conversation_history[-6:]
+        except Exception as e:
+            logger.error(f"Error in image processing: {str(e)}")
+            return f"I encountered an error while processing the image. Please try again. Error: {str(e)}"
+
+    async def aprocess_image_with_text(self, image_data: str, text_query: Optional[str] = None,
+                                       session: Optional[ChatSession] = None) -> str:
+        """Async process_image_with_text"""
+        try:
+            message = self._build_image_message(image_data, text_query)
+
+            # Use the LLM directly for image processing
+            response = await self.llm.ainvoke([message])
+
+            # Update conversation history
+            (session or self.default_session).add_turn(
+                f"[Image analysis request] {text_query if text_query else ''}",
+                response.content
+            )
 
             return response.content
 
@@ -345,6 +373,9 @@ USER_DATABASE = {
 
 security = HTTPBasic()
 
+# Chat sessions keyed by user (and optional X-Session-ID), idle ones expire after 30 minutes
+session_store = SessionStore(max_sessions=1000, ttl_seconds=1800)
+
 app = FastAPI(
     title="Machine Breakdown RAG API",
     description="API for interacting with the Machine Breakdown RAG system",
@@ -379,6 +410,7 @@ class ExampleResponse(BaseModel):
 class HealthResponse(BaseModel):
     status: str
     message: str
+    cache: Optional[Dict[str, Dict[str, float]]] = None
 
 class LoginResponse(BaseModel):
     status: str
@@ -402,12 +434,24 @@ def verify_user(credentials: HTTPBasicCredentials = Depends(security)):
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Basic"},
         )
-    return user
+    return {**user, "username": credentials.username}
+
+def get_session(
+    user: Dict = Depends(verify_user),
+    x_session_id: Optional[str] = Header(None)
+) -> ChatSession:
+    """Resolve the caller's chat session; scoped to the user so IDs cannot cross accounts"""
+    session_id = f"{user['username']}:{x_session_id or 'default'}"
+    return session_store.get(session_id, user["plant"])
 
 @app.get("/api/health")
 async def health_check() -> HealthResponse:
-    status, message = rag_system.verify_connection()
-    return HealthResponse(status="ok" if status else "error", message=message)
+    status, message = await rag_system.retriever_pool.verify_connection()
+    return HealthResponse(
+        status="ok" if status else "error",
+        message=message,
+        cache=cache_metrics(rag_system.embeddings, rag_system.answer_cache)
+    )
 
 @app.get("/api/examples")
 async def get_example_questions() -> ExampleResponse:
@@ -415,38 +459,57 @@ async def get_example_questions() -> ExampleResponse:
     return ExampleResponse(examples=EXAMPLE_QUESTIONS)
 
 @app.post("/api/login")
-async def login(user: Dict = Depends(verify_user)) -> LoginResponse:
+async def login(user: Dict = Depends(verify_user), session: ChatSession = Depends(get_session)) -> LoginResponse:
     """Login endpoint"""
     try:
-        rag_system.switch_collection(user["plant"])
         return LoginResponse(
             status="success",
             plant=user["plant"],
             message=f"Logged in to plant {user['plant']} collection"
         )
     except Exception as e:
-        logger.error(f"Error switching collection: {str(e)}")
+        logger.error(f"Error starting session: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/chat")
 async def process_query(
     query: QueryRequest,
-    user: Dict = Depends(verify_user)
+    session: ChatSession = Depends(get_session)
 ) -> QueryResponse:
     """Process chat query"""
     try:
-        rag_system.switch_collection(user["plant"])
-        answer = rag_system.query(query.question)
+        answer = await rag_system.aquery(query.question, session)
         return QueryResponse(answer=answer)
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/stream")
+async def stream_query(
+    query: QueryRequest,
+    session: ChatSession = Depends(get_session)
+) -> StreamingResponse:
+    """Stream the chat answer as Server-Sent Events (read with fetch, since EventSource cannot POST)"""
+    async def event_stream():
+        try:
+            async for token in rag_system.astream_query(query.question, session):
+                yield sse_event({"token": token})
+            yield sse_event({"status": "success"}, event="done")
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield sse_event({"detail": str(e)}, event="error")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/chat-with-image")
 async def process_image_query(
     image: UploadFile = File(...),
     text_query: Optional[str] = Form(None),
-    user: Dict = Depends(verify_user)
+    session: ChatSession = Depends(get_session)
 ) -> ImageQueryResponse:
     """Process image query with optional text"""
     try:
@@ -456,7 +519,7 @@ async def process_image_query(
         data_url = f"data:{image.content_type};base64,{base64_image}"
         
         # Process the image
-        answer = rag_system.process_image_with_text(data_url, text_query)
+        answer = await rag_system.aprocess_image_with_text(data_url, text_query, session)
         return ImageQueryResponse(answer=answer)
     except Exception as e:
         logger.error(f"Error processing image query: {str(e)}")
@@ -0,0 +1,87 @@
+from typing import List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+from sparse_index import SPARSE_VECTOR_NAME, BM25SparseEncoder
+
+
+class AsyncQdrantRetriever(BaseRetriever):
+    """Similarity retriever with a native async path through AsyncQdrantClient
+
+    QdrantVectorStore's async search runs the sync search in a thread; this
+    awaits the query embedding and the Qdrant call instead, so a chain's
+    ainvoke never blocks the event loop on retrieval. Embedders without a
+    native async API fall back to LangChain's thread pool in aembed_query.
+    Callers that already embedded the question pass it as vector=.
+
+    With a sparse_encoder the dense and BM25 searches run as prefetches of
+    one query and Qdrant fuses them with reciprocal rank fusion, so exact
+    SAP codes, Unique IDs and line names rank alongside semantic matches.
+    """
+
+    client: QdrantClient
+    async_client: AsyncQdrantClient
+    collection_name: str
+    embeddings: Embeddings
+    k: int = 4
+    sparse_encoder: Optional[BM25SparseEncoder] = None
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @staticmethod
+    def _to_document(payload: Optional[dict]) -> Document:
+        payload = payload or {}
+        if QdrantVectorStore.METADATA_KEY in payload:
+            return Document(
+                page_content=payload.get(QdrantVectorStore.CONTENT_KEY) or '',
+                metadata=payload.get(QdrantVectorStore.METADATA_KEY) or {}
+            )
+        # Points from older preprocessing runs hold the metadata flat, record text included
+        return Document(
+            page_content=payload.get('human_readable_text') or payload.get('full_text') or '',
+            metadata=payload
+        )
+
+    def _to_documents(self, points) -> List[Document]:
+        return [self._to_document(point.payload) for point in points]
+
+    def _query_kwargs(self, query: str, vector: List[float]) -> dict:
+        if self.sparse_encoder is None:
+            return {"query": vector}
+        return {
+            "prefetch": [
+                models.Prefetch(query=vector, limit=self.k),
+                models.Prefetch(query=self.sparse_encoder.encode_query(query),
+                                using=SPARSE_VECTOR_NAME, limit=self.k)
+            ],
+            "query": models.FusionQuery(fusion=models.Fusion.RRF)
+        }
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                vector: Optional[List[float]] = None) -> List[Document]:
+        if vector is None:
+            vector = self.embeddings.embed_query(query)
+        response = self.client.query_points(
+            collection_name=self.collection_name,
+            limit=self.k,
+            with_payload=True,
+            **self._query_kwargs(query, vector)
+        )
+        return self._to_documents(response.points)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       vector: Optional[List[float]] = None) -> List[Document]:
+        if vector is None:
+            vector = await self.embeddings.aembed_query(query)
+        response = await self.async_client.query_points(
+            collection_name=self.collection_name,
+            limit=self.k,
+            with_payload=True,
+            **self._query_kwargs(query, vector)
+        )
+        return self._to_documents(response.points)
@@ -1,19 +1,21 @@
 import logging
 import os
 from datetime import datetime
-from typing import List, Dict
+from typing import Any, AsyncIterator, List, Dict, Optional
 import httpx
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from qdrant_client import QdrantClient
 from langchain_community.chat_models import ChatOllama
 from langchain_community.embeddings import OllamaEmbeddings
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_qdrant import QdrantVectorStore
+from rag_backend import QdrantRetrieverPool, cache_metrics, sse_event
+from reranker import load_reranker
+from rag_chain import build_rag_chain
+from context_builder import ContextBuilder
+from embedding_cache import QueryEmbeddingCache
+from semantic_cache import CollectionVersions, SemanticAnswerCache
 
 
 # Configure logging
@@ -41,7 +43,10 @@ class MachineBreakdownRAG:
             }
         )
         
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
+        # Repeated questions skip the Ollama round-trip; pass cache_dir to keep vectors across restarts
+        self.embeddings = QueryEmbeddingCache(
+            OllamaEmbeddings(model="nomic-embed-text"), "nomic-embed-text", max_entries=2048
+        )
         self.collection_names = {
             'Master': 'machine_data_master',
             '1150': 'machine_data_1150',
@@ -49,68 +54,39 @@ class MachineBreakdownRAG:
             '1250': 'machine_data_1250',
             '1300': 'machine_data_1300'
         }
-        self.user_role = user_role
-        self.vector_store = self._initialize_vector_store()
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 5}  
+        self.retriever_k = 5
+        # The reranker keeps the same retriever_k records the plain search would
+        self.reranker = load_reranker(top_n=self.retriever_k, latency_budget_ms=300)
+        self.retriever_pool = QdrantRetrieverPool(
+            self.collection_names, self.embeddings, k=self.retriever_k, reranker=self.reranker
         )
+
+        self.user_role = user_role if user_role in self.collection_names else 'Master'
+        self.vector_store, self.retriever = self.retriever_pool.get(self.user_role)
         self.conversation_history = []
-        
-    def _initialize_vector_store(self):
-        client = QdrantClient(
-            host="localhost",
-            port=6333,
-            timeout=30.0
+        # num_ctx=2048 has to hold the prompt, history and the answer; this is the prompt's share
+        self.context_builder = ContextBuilder(max_tokens=1400)
+        # Plant retriever and history are inputs, so switching plants never rebuilds the chain
+        self.rag_chain = self._build_rag_chain()
+        # Near-duplicate questions per plant are answered from memory until that collection is re-ingested
+        self.answer_cache = SemanticAnswerCache(
+            similarity_threshold=0.95,
+            max_entries=500,
+            ttl_seconds=3600,
+            versions=CollectionVersions()
         )
-        collection_name = self.collection_names.get(self.user_role, 'machine_data_master')
-        return QdrantVectorStore(
-            client=client,
-            collection_name=collection_name,
-            embedding=self.embeddings
-        )
-    
-    def switch_collection(self, new_role: str):
+        
+    async def switch_collection(self, new_role: str):
+        if new_role == self.user_role:
+            return
         if new_role in self.collection_names:
+            self.vector_store, self.retriever = await self.retriever_pool.aget(new_role)
             self.user_role = new_role
-            self.vector_store = self._initialize_vector_store()
-            self.retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}
-            )
             logger.info(f"Switched to collection for {new_role}")
         else:
             logger.warning(f"Invalid role: {new_role}. Keeping current collection.")
     
-    def verify_connection(self):
-        try:
-            self.vector_store.client.get_collections()
-            return True, "Connected to Qdrant and vector store is ready"
-        except Exception as e:
-            return False, f"Connection error: {str(e)}"
-        
-    def _format_docs(self, docs: List[Dict]) -> str:
-        formatted = []
-        for doc in docs:
-            formatted.append(
-                f"### Machine Breakdown Record\n"
-                f"**Machine Name:** {doc.metadata.get('machine_name', 'Unknown')}\n"
-                f"**SAP Code:** {doc.metadata.get('sap_code', 'Unknown')}\n"
-                f"**Plant:** {doc.metadata.get('plant', 'Unknown')}\n"
-                f"**Shop:** {doc.metadata.get('shop', 'Unknown')}\n"
-                f"**Module:** {doc.metadata.get('module', 'Unknown')}\n"
-                f"**Line:** {doc.metadata.get('line', 'Unknown')}\n"
-                f"**Problem Type:** {doc.metadata.get('problem_type', 'Unknown')}\n"
-                f"**Shift:** {doc.metadata.get('shift', 'Unknown')}\n"
-                f"**Duration (Minutes):** {doc.metadata.get('duration_minutes', 0)} minutes\n"
-                f"**Start Time:** {doc.metadata.get('start_time', 'Unknown')}\n"
-                f"**End Time:** {doc.metadata.get('end_time', 'Unknown')}\n"
-                f"**Problem:** {doc.metadata.get('problem', 'Unknown')}\n"
-                f"**Solution:** {doc.metadata.get('solution', 'No solution provided')}\n"
-            )
-        return "\n\n".join(formatted)
-    
-    def _get_rag_chain(self):
+    def _build_rag_chain(self):
         template = """You are an expert technician assistant analyzing machine breakdown data. 
         Respond ONLY in this exact format with these sections (include the section headers):
 
@@ -140,24 +116,32 @@ class MachineBreakdownRAG:
         
         Provide ONLY the formatted response, no additional commentary:"""
         
-        prompt = ChatPromptTemplate.from_template(template)
-        
-        return (
-            {
-                "context": self.retriever | self._format_docs,
-                "question": RunnablePassthrough(),
-                "history": lambda _: "\n".join(self.conversation_history[-3:]),
-                "time": lambda _: datetime.now().strftime("%I:%M %p")
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
+        return build_rag_chain(
+            template,
+            self.llm,
+            self.context_builder.build,
+            reserve_prompt=True,
+            time=lambda _: datetime.now().strftime("%I:%M %p")
         )
+
+    def _chain_input(self, question: str) -> Dict[str, Any]:
+        """Snapshot of retriever and history taken before the first await in aquery/astream_query"""
+        return {
+            "question": question,
+            "history": "\n".join(self.conversation_history[-3:]),
+            "retriever": self.retriever
+        }
     
     def query(self, question: str) -> str:
-        rag_chain = self._get_rag_chain()
+        collection = self.collection_names[self.user_role]
+        chain_input = self._chain_input(question)
         try:
-            response = rag_chain.invoke(question)
+            question_vector = self.embeddings.embed_query(question)
+            chain_input["question_vector"] = question_vector
+            response = self.answer_cache.lookup(collection, question_vector, chain_input["history"])
+            if response is None:
+                response = self.rag_chain.invoke(chain_input)
+                self.answer_cache.store(collection, question, question_vector, response, chain_input["history"])
             self.conversation_history.append(f"User: {question}")
             self.conversation_history.append(f"Assistant: {response}")
             
@@ -169,6 +153,53 @@ class MachineBreakdownRAG:
             logger.error(f"Error in query processing: {str(e)}")
             return f"Error processing your request. Please try again. Technical details: {str(e)}"
 
+    async def aquery(self, question: str) -> str:
+        collection = self.collection_names[self.user_role]
+        chain_input = self._chain_input(question)
+        try:
+            question_vector = await self.embeddings.aembed_query(question)
+            chain_input["question_vector"] = question_vector
+            response = await self.answer_cache.alookup(collection, question_vector, chain_input["history"])
+            if response is None:
+                response = await self.rag_chain.ainvoke(chain_input)
+                await self.answer_cache.astore(collection, question, question_vector, response, chain_input["history"])
+            self.conversation_history.append(f"User: {question}")
+            self.conversation_history.append(f"Assistant: {response}")
+            
+            if len(self.conversation_history) > 6:
+                self.conversation_history = self.conversation_history[-6:]
+                
+            return response
+        except Exception as e:
+            logger.error(f"Error in query processing: {str(e)}")
+            return f"Error processing your request. Please try again. Technical details: {str(e)}"
+
+    def astream_query(self, question: str) -> AsyncIterator[str]:
+        # Capture the caller's plant retriever and history before the stream starts
+        collection = self.collection_names[self.user_role]
+        chain_input = self._chain_input(question)
+
+        async def stream():
+            question_vector = await self.embeddings.aembed_query(question)
+            chain_input["question_vector"] = question_vector
+            response = await self.answer_cache.alookup(collection, question_vector, chain_input["history"])
+            if response is not None:
+                yield response
+            else:
+                chunks = []
+                async for chunk in self.rag_chain.astream(chain_input):
+                    chunks.append(chunk)
+                    yield chunk
+                response = "".join(chunks)
+                await self.answer_cache.astore(collection, question, question_vector, response, chain_input["history"])
+            self.conversation_history.append(f"User: {question}")
+            self.conversation_history.append(f"Assistant: {response}")
+            
+            if len(self.conversation_history) > 6:
+                self.conversation_history = self.conversation_history[-6:]
+
+        return stream()
+
 # Initialize RAG system
 rag_system = MachineBreakdownRAG()
 
@@ -213,6 +244,7 @@ class ExampleResponse(BaseModel):
 class HealthResponse(BaseModel):
     status: str
     message: str
+    cache: Optional[Dict[str, Dict[str, float]]] = None
 
 class LoginResponse(BaseModel):
     status: str
@@ -240,8 +272,12 @@ def verify_user(credentials: HTTPBasicCredentials = Depends(security)):
 
 @app.get("/api/health")
 async def health_check() -> HealthResponse:
-    status, message = rag_system.verify_connection()
-    return HealthResponse(status="ok" if status else "error", message=message)
+    status, message = await rag_system.retriever_pool.verify_connection()
+    return HealthResponse(
+        status="ok" if status else "error",
+        message=message,
+        cache=cache_metrics(rag_system.embeddings, rag_system.answer_cache)
+    )
 
 @app.get("/api/examples")
 async def get_example_questions() -> ExampleResponse:
@@ -252,7 +288,7 @@ async def get_example_questions() -> ExampleResponse:
 async def login(user: Dict = Depends(verify_user)) -> LoginResponse:
     """Login endpoint"""
     try:
-        rag_system.switch_collection(user["plant"])
+        await rag_system.switch_collection(user["plant"])
         return LoginResponse(
             status="success",
             plant=user["plant"],
@@ -269,13 +305,37 @@ async def process_query(
 ) -> QueryResponse:
     """Process chat query"""
     try:
-        rag_system.switch_collection(user["plant"])
-        answer = rag_system.query(query.question)
+        await rag_system.switch_collection(user["plant"])
+        answer = await rag_system.aquery(query.question)
         return QueryResponse(answer=answer)
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/stream")
+async def stream_query(
+    query: QueryRequest,
+    user: Dict = Depends(verify_user)
+) -> StreamingResponse:
+    """Stream the chat answer as Server-Sent Events (read with fetch, since EventSource cannot POST)"""
+    await rag_system.switch_collection(user["plant"])
+    tokens = rag_system.astream_query(query.question)
+
+    async def event_stream():
+        try:
+            async for token in tokens:
+                yield sse_event({"token": token})
+            yield sse_event({"status": "success"}, event="done")
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield sse_event({"detail": str(e)}, event="error")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import logging
+import os
+import time
+import tempfile
+import pandas as pd
+from preprocessing import DataProcessor
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DATA_FILE = 'SFMS_Data.xlsx'
+
+
+def _time_mode(processor: DataProcessor, df: pd.DataFrame, columnar: bool):
+    start = time.perf_counter()
+    documents = processor.create_documents(df.copy(), columnar=columnar)
+    return time.perf_counter() - start, documents
+
+
+def run_benchmark(data_file: str = DATA_FILE, repeats: int = 3):
+    """Compare the iterrows and columnar document builders on the same frame"""
+    processor = DataProcessor()
+    # Point the progress log at an empty location so every row is built
+    processor.progress_db = os.path.join(tempfile.mkdtemp(), 'vectorization_progress.db')
+
+    logger.info(f"Loading {data_file}...")
+    df = processor._prepare_frame(pd.read_excel(data_file))
+    logger.info(f"Loaded {len(df)} rows")
+
+    timings = {'rowwise': [], 'columnar': []}
+    results = {}
+    for _ in range(repeats):
+        for mode in ('rowwise', 'columnar'):
+            elapsed, documents = _time_mode(processor, df, columnar=(mode == 'columnar'))
+            timings[mode].append(elapsed)
+            results[mode] = documents
+
+    # Both modes must emit identical documents for every collection
+    for collection in set(results['rowwise']) | set(results['columnar']):
+        rowwise_docs = results['rowwise'].get(collection, [])
+        columnar_docs = results['columnar'].get(collection, [])
+        assert len(rowwise_docs) == len(columnar_docs), f"Count mismatch in {collection}"
+        for a, b in zip(rowwise_docs, columnar_docs):
+            assert a.page_content == b.page_content, f"Text mismatch for {a.metadata.get('unique_id')}"
+            assert a.metadata == b.metadata, f"Metadata mismatch for {a.metadata.get('unique_id')}"
+
+    rowwise_best = min(timings['rowwise'])
+    columnar_best = min(timings['columnar'])
+    print(f"Rows:      {len(df)}")
+    print(f"Row-wise:  {rowwise_best:.2f}s (best of {repeats})")
+    print(f"Columnar:  {columnar_best:.2f}s (best of {repeats})")
+    print(f"Speedup:   {rowwise_best / columnar_best:.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,75 @@
+import ast
+import logging
+import time
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+from rag_chain import build_rag_chain
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BACKEND_FILE = 'Gemini_Working_Model.py'
+
+
+class StaticRetriever(BaseRetriever):
+    """Returns the same documents for every question, so only chain overhead is timed"""
+
+    documents: list
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+
+def _load_template(path: str) -> str:
+    """Read the prompt template out of a backend's _build_rag_chain without importing it
+
+    Importing a backend module starts its models and Qdrant connections.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == '_build_rag_chain':
+            for stmt in node.body:
+                if isinstance(stmt, ast.Assign) and stmt.targets[0].id == 'template':
+                    return stmt.value.value
+    raise ValueError(f"No _build_rag_chain template found in {path}")
+
+
+def _format_docs(docs) -> str:
+    return "\n".join(doc.page_content for doc in docs)
+
+
+def run_benchmark(backend_file: str = BACKEND_FILE, requests: int = 2000):
+    """Compare building the chain per query against reusing one compiled chain"""
+    template = _load_template(backend_file)
+    llm = FakeListChatModel(responses=["### 🎯 Executive Summary\nOK"])
+    retriever = StaticRetriever(documents=[
+        Document(page_content=f"Breakdown record {i}") for i in range(5)
+    ])
+    chain_input = {"question": "Which machine has the highest downtime?",
+                   "history": "No history", "retriever": retriever}
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        build_rag_chain(template, llm, _format_docs).invoke(chain_input)
+    per_request = (time.perf_counter() - start) / requests
+
+    compiled_chain = build_rag_chain(template, llm, _format_docs)
+    start = time.perf_counter()
+    for _ in range(requests):
+        compiled_chain.invoke(chain_input)
+    compiled = (time.perf_counter() - start) / requests
+
+    print(f"Requests:          {requests} (fake LLM and retriever, {len(template)} char template)")
+    print(f"Build per query:   {per_request * 1000:.3f} ms/request")
+    print(f"Compiled once:     {compiled * 1000:.3f} ms/request")
+    print(f"Overhead removed:  {(per_request - compiled) * 1000:.3f} ms/request")
+
+
+if __name__ == "__main__":
+    run_benchmark()
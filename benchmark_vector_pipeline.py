@@ -0,0 +1,52 @@
+import logging
+import os
+import time
+import tempfile
+import pandas as pd
+from preprocessing import DataProcessor
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DATA_FILE = 'SFMS_Data.xlsx'
+
+
+def run_benchmark(data_file: str = DATA_FILE, sample_size: int = 2000):
+    """Compare the serial and pipelined vector store builders against live Ollama and Qdrant"""
+    processor = DataProcessor()
+    scratch_dir = tempfile.mkdtemp()
+    processor.progress_db = os.path.join(scratch_dir, 'vectorization_progress.db')
+    processor.collection_versions_db = os.path.join(scratch_dir, 'collection_versions.db')
+    # Both modes must call Ollama; a warm embedding cache would hand the second run its vectors
+    processor.use_embedding_cache = False
+
+    df = processor._prepare_frame(pd.read_excel(data_file, nrows=sample_size))
+    docs = processor.create_documents(df)['master']
+    client = processor._get_qdrant_client()
+
+    timings = {}
+    for mode in ('serial', 'pipelined'):
+        # Scratch collections so the real machine_data_* collections are untouched
+        scratch_collection = f"benchmark_pipeline_{mode}"
+        processor.collection_names = {'master': scratch_collection}
+
+        start = time.perf_counter()
+        processor.create_vector_stores({'master': docs}, pipelined=(mode == 'pipelined'))
+        timings[mode] = time.perf_counter() - start
+
+        client.delete_collection(scratch_collection)
+        processor._get_checkpoints().clear()
+
+    print(f"Documents: {len(docs)} (batch size {processor.batch_size})")
+    print(f"Serial:    {timings['serial']:.1f}s ({len(docs) / timings['serial']:.1f} docs/s)")
+    print(f"Pipelined: {timings['pipelined']:.1f}s ({len(docs) / timings['pipelined']:.1f} docs/s, "
+          f"{processor.embed_workers} embed / {processor.upload_workers} upload workers)")
+    print(f"Speedup:   {timings['serial'] / timings['pipelined']:.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,216 @@
+import csv
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Iterable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """SQLite-backed record of which Unique_ID_No values each collection already holds"""
+
+    def __init__(self, db_path: str = 'vectorization_progress.db'):
+        self.db_path = db_path
+        self.lookup_chunk_size = 500  # Stay well below SQLite's bound-parameter limit
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed_ids (
+                collection TEXT NOT NULL,
+                unique_id TEXT NOT NULL,
+                processed_at TEXT NOT NULL,
+                PRIMARY KEY (collection, unique_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS source_keys (
+                source TEXT NOT NULL,
+                unique_id TEXT NOT NULL,
+                PRIMARY KEY (source, unique_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS staged_keys (
+                source TEXT NOT NULL,
+                unique_id TEXT NOT NULL,
+                PRIMARY KEY (source, unique_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    def mark_processed(self, collection: str, unique_ids: Iterable[str]):
+        """Record a batch of processed IDs in a single transaction"""
+        timestamp = datetime.now().isoformat()
+        rows = [(collection, str(uid), timestamp) for uid in unique_ids if uid]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO processed_ids (collection, unique_id, processed_at) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def remove(self, unique_ids: Iterable[str], collection: str = None):
+        """Forget processed IDs in one collection, or in all of them"""
+        ids = [str(uid) for uid in unique_ids if uid]
+        with self._lock:
+            for i in range(0, len(ids), self.lookup_chunk_size):
+                chunk = ids[i:i + self.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                if collection is None:
+                    self._conn.execute(f"DELETE FROM processed_ids WHERE unique_id IN ({placeholders})", chunk)
+                else:
+                    self._conn.execute(
+                        f"DELETE FROM processed_ids WHERE collection = ? AND unique_id IN ({placeholders})",
+                        [collection, *chunk]
+                    )
+            self._conn.commit()
+
+    def is_processed(self, collection: str, unique_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM processed_ids WHERE collection = ? AND unique_id = ?",
+                (collection, str(unique_id))
+            ).fetchone()
+        return row is not None
+
+    def filter_processed(self, collection: str, unique_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of unique_ids already processed for a collection"""
+        candidates: List[str] = list({str(uid) for uid in unique_ids if uid})
+        processed = set()
+        with self._lock:
+            for i in range(0, len(candidates), self.lookup_chunk_size):
+                chunk = candidates[i:i + self.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self._conn.execute(
+                    f"SELECT unique_id FROM processed_ids "
+                    f"WHERE collection = ? AND unique_id IN ({placeholders})",
+                    [collection, *chunk]
+                )
+                processed.update(row[0] for row in cursor)
+        return processed
+
+    def clear(self, collection: str = None):
+        """Drop checkpoints for one collection, or all of them"""
+        with self._lock:
+            if collection is None:
+                self._conn.execute("DELETE FROM processed_ids")
+            else:
+                self._conn.execute("DELETE FROM processed_ids WHERE collection = ?", (collection,))
+            self._conn.commit()
+
+    def import_csv(self, csv_path: str) -> int:
+        """One-time import of the legacy vectorization_progress.csv log"""
+        if not os.path.exists(csv_path) or self.get_meta(f"imported:{os.path.abspath(csv_path)}"):
+            return 0
+
+        imported = 0
+        with open(csv_path, 'r', newline='') as f:
+            reader = csv.DictReader(f)
+            batch = []
+            for row in reader:
+                if str(row.get('Processed', '')).lower() != 'true':
+                    continue
+                batch.append((
+                    row['Collection'],
+                    row['Unique_ID_No'],
+                    row.get('Timestamp') or datetime.now().isoformat()
+                ))
+                if len(batch) >= 10000:
+                    imported += self._insert_rows(batch)
+                    batch = []
+            imported += self._insert_rows(batch)
+
+        self.set_meta(f"imported:{os.path.abspath(csv_path)}", datetime.now().isoformat())
+        logger.info(f"Imported {imported} checkpoints from {csv_path}")
+        return imported
+
+    def _insert_rows(self, rows: list) -> int:
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO processed_ids (collection, unique_id, processed_at) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def has_keys(self, source: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM source_keys WHERE source = ? LIMIT 1", (source,)).fetchone()
+        return row is not None
+
+    def stage_keys(self, source: str, unique_ids: Iterable[str], reset: bool = False):
+        """Stage the Unique_ID_No values from the current key scan"""
+        with self._lock:
+            if reset:
+                self._conn.execute("DELETE FROM staged_keys WHERE source = ?", (source,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO staged_keys (source, unique_id) VALUES (?, ?)",
+                [(source, str(uid)) for uid in unique_ids]
+            )
+            self._conn.commit()
+
+    def diff_keys(self, source: str) -> Tuple[List[str], List[str]]:
+        """Compare staged keys with the committed ones: (inserted, deleted)"""
+        with self._lock:
+            inserted = [row[0] for row in self._conn.execute(
+                """
+                SELECT s.unique_id FROM staged_keys s
+                LEFT JOIN source_keys k ON k.source = s.source AND k.unique_id = s.unique_id
+                WHERE s.source = ? AND k.unique_id IS NULL
+                """, (source,)
+            )]
+            deleted = [row[0] for row in self._conn.execute(
+                """
+                SELECT k.unique_id FROM source_keys k
+                LEFT JOIN staged_keys s ON s.source = k.source AND s.unique_id = k.unique_id
+                WHERE k.source = ? AND s.unique_id IS NULL
+                """, (source,)
+            )]
+        return inserted, deleted
+
+    def commit_keys(self, source: str):
+        """Make the staged key scan the new baseline for the next diff"""
+        with self._lock:
+            self._conn.execute("DELETE FROM source_keys WHERE source = ?", (source,))
+            self._conn.execute(
+                "INSERT INTO source_keys (source, unique_id) "
+                "SELECT source, unique_id FROM staged_keys WHERE source = ?",
+                (source,)
+            )
+            self._conn.execute("DELETE FROM staged_keys WHERE source = ?", (source,))
+            self._conn.commit()
+
+    def get_meta(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+                (key, str(value))
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
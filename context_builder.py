@@ -0,0 +1,138 @@
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# (label, metadata keys tried in order); covers both ingestion schemas.
+# human_readable_text and full_text are left out: they repeat these fields as prose.
+DEFAULT_FIELDS: List[Tuple[str, Sequence[str]]] = [
+    ("Machine", ("machine_name",)),
+    ("SAP", ("sap_code",)),
+    ("Plant", ("plant_name", "plant")),
+    ("Shop", ("shop",)),
+    ("Module", ("module",)),
+    ("Line", ("line",)),
+    ("Problem type", ("problem_type",)),
+    ("Shift", ("shift",)),
+    ("Downtime min", ("duration_minutes",)),
+    ("Start", ("start_time",)),
+    ("End", ("end_time",)),
+    ("Problem", ("problem",)),
+    ("Phenomena", ("phenomena",)),
+    ("Solution", ("solution",)),
+    ("Details", ("details",)),
+    ("Closure", ("closure_reason",)),
+]
+
+EMPTY_VALUES = {'', 'unknown', 'none', 'nan', 'null', 'n/a', 'no solution provided',
+                'no details provided', 'no problem provided'}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting without a tokenizer"""
+    return max(1, len(text) // 4)
+
+
+class ContextBuilder:
+    """Packs retrieved breakdown records into a prompt context under a token budget
+
+    Records are deduplicated by unique_id and rendered as one compact line
+    each, packed highest rerank_score first (retrieval order when unscored)
+    until the budget is used. Fields shared by every packed record are
+    stated once in a header. max_tokens covers the whole prompt when the
+    chain passes the rest of it (template, question, history) as
+    reserved_text.
+    """
+
+    def __init__(self, max_tokens: int, fields: Optional[List[Tuple[str, Sequence[str]]]] = None,
+                 max_field_chars: int = 300, token_counter: Callable[[str], int] = estimate_tokens):
+        self.max_tokens = max_tokens
+        self.fields = fields or DEFAULT_FIELDS
+        self.max_field_chars = max_field_chars
+        self.token_counter = token_counter
+
+    def _field_values(self, doc: Document) -> Dict[str, str]:
+        values = {}
+        for label, keys in self.fields:
+            for key in keys:
+                value = doc.metadata.get(key)
+                text = str(value).strip() if value is not None else ''
+                if text.lower() not in EMPTY_VALUES:
+                    if len(text) > self.max_field_chars:
+                        text = text[:self.max_field_chars].rstrip() + "…"
+                    values[label] = text
+                    break
+        return values
+
+    def _unique_records(self, docs: List[Document]) -> List[Dict[str, str]]:
+        # Stable sort keeps the retriever's order among unscored records, which go last
+        ranked = sorted(docs, key=lambda d: d.metadata.get('rerank_score', float('-inf')), reverse=True)
+        seen_ids, seen_bodies, records = set(), set(), []
+        for doc in ranked:
+            unique_id = doc.metadata.get('unique_id')
+            if unique_id and unique_id in seen_ids:
+                continue
+            values = self._field_values(doc) or {"Record": doc.page_content}
+            body = tuple(sorted(values.items()))
+            if body in seen_bodies:
+                continue
+            if unique_id:
+                seen_ids.add(unique_id)
+            seen_bodies.add(body)
+            records.append(values)
+        return records
+
+    def _common_fields(self, records: List[Dict[str, str]]) -> Dict[str, str]:
+        """Fields with the same value in every record"""
+        common = {}
+        if len(records) > 1:
+            for label, _ in self.fields:
+                value = records[0].get(label)
+                if value is not None and all(r.get(label) == value for r in records[1:]):
+                    common[label] = value
+        return common
+
+    @staticmethod
+    def _line(number: int, values: Dict[str, str], common: Dict[str, str]) -> str:
+        return f"[{number}] " + " | ".join(f"{k}: {v}" for k, v in values.items() if k not in common)
+
+    def build(self, docs: List[Document], reserved_text: str = '') -> str:
+        records = self._unique_records(docs)
+        if not records:
+            return "No matching breakdown records."
+        budget = self.max_tokens - (self.token_counter(reserved_text) if reserved_text else 0)
+
+        # Priced at full length; moving shared fields into the header afterwards only saves tokens
+        packed, used = [], 0
+        for values in records:
+            cost = self.token_counter(self._line(len(packed) + 1, values, {}))
+            if used + cost > budget:
+                continue
+            packed.append(values)
+            used += cost
+
+        # A record whose fields all went into the header would add nothing but its number
+        common = self._common_fields(packed)
+        while common:
+            informative = [v for v in packed if any(k not in common for k in v)]
+            if len(informative) == len(packed):
+                break
+            packed = informative
+            common = self._common_fields(packed)
+
+        parts = []
+        if common:
+            parts.append("All records: " + " | ".join(f"{k}: {v}" for k, v in common.items()))
+        parts.extend(self._line(i, values, common) for i, values in enumerate(packed, 1))
+        used = sum(self.token_counter(p) for p in parts)
+
+        if not packed:
+            logger.warning(f"📦 Context budget exhausted: {self.max_tokens} tokens, "
+                           f"~{self.max_tokens - budget} taken by the rest of the prompt")
+        logger.info(
+            f"📦 Context: {len(packed)} of {len(records)} unique records from {len(docs)} retrieved, "
+            f"~{used} tokens (budget {budget})"
+        )
+        return "\n".join(parts)
@@ -0,0 +1,213 @@
+import logging
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional
+
+import pandas as pd
+from sqlalchemy import text, bindparam
+
+from checkpoint_store import CheckpointStore
+
+logger = logging.getLogger(__name__)
+
+
+class Delta(NamedTuple):
+    full_reload: bool  # No usable baseline; stream the whole table
+    inserted_ids: List[str]
+    updated_ids: List[str]
+    deleted_ids: List[str]
+    watermark: Optional[str]  # Change tracking version or high-water mark to commit
+
+    @property
+    def changed_ids(self) -> List[str]:
+        return self.inserted_ids + self.updated_ids
+
+
+class BreakdownDeltaSource:
+    """Detects inserted, updated and deleted breakdown rows since the last committed run
+
+    Uses SQL Server change tracking when it is enabled on the table, keyed on
+    CHANGE_TRACKING_CURRENT_VERSION() as the high-water mark. Otherwise inserts
+    and updates come from a high-water mark on a rowversion column, or failing
+    that on StartDate with a trailing lookback window, and deletes from a
+    key-only scan diffed against the keys stored in the checkpoint store.
+    Edits to rows older than the lookback window need rowversion or change
+    tracking to be seen.
+    """
+
+    def __init__(self, engine, table: str, store: CheckpointStore, key_column: str = 'Unique_ID_No',
+                 date_column: str = 'StartDate', lookback_days: int = 7):
+        self.engine = engine
+        self.table = table
+        self.store = store
+        self.key_column = key_column
+        self.date_column = date_column
+        self.lookback_days = lookback_days
+        self.scan_chunk_size = 50000
+        self.id_chunk_size = 1000  # SQL Server allows at most 2100 parameters per statement
+        self._mode: Optional[str] = None
+
+    @property
+    def _version_key(self) -> str:
+        return f"ct_version:{self.table}"
+
+    @property
+    def _watermark_key(self) -> str:
+        # Per mode, so adding a rowversion column later starts from a fresh baseline
+        return f"{self._mode}:{self.table}"
+
+    def _change_tracking_enabled(self, conn) -> bool:
+        try:
+            row = conn.execute(
+                text("SELECT 1 FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID(:table)"),
+                {"table": self.table}
+            ).fetchone()
+            return row is not None
+        except Exception as e:
+            logger.debug(f"Change tracking lookup failed for {self.table}: {e}")
+            return False
+
+    def detect_changes(self) -> Delta:
+        with self.engine.connect() as conn:
+            if self._change_tracking_enabled(conn):
+                self._mode = 'change_tracking'
+                delta = self._detect_with_change_tracking(conn)
+            else:
+                rowversion = self._rowversion_column(conn)
+                if rowversion:
+                    self._mode = 'rowversion'
+                    delta = self._detect_with_rowversion(conn, rowversion)
+                else:
+                    self._mode = 'start_date'
+                    delta = self._detect_with_start_date(conn)
+
+        if delta.full_reload:
+            logger.info(f"🔍 {self.table}: no usable baseline ({self._mode}), full reload")
+        else:
+            logger.info(
+                f"🔍 {self.table} ({self._mode}): {len(delta.inserted_ids)} inserted, "
+                f"{len(delta.updated_ids)} updated, {len(delta.deleted_ids)} deleted"
+            )
+        return delta
+
+    def _detect_with_change_tracking(self, conn) -> Delta:
+        # Read the current version first so changes made during this run are seen next time
+        current_version = conn.execute(text("SELECT CHANGE_TRACKING_CURRENT_VERSION()")).scalar()
+        min_valid_version = conn.execute(
+            text("SELECT CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(:table))"),
+            {"table": self.table}
+        ).scalar()
+        last_version = self.store.get_meta(self._version_key)
+
+        if last_version is None or int(last_version) < int(min_valid_version or 0):
+            if last_version is not None:
+                logger.warning(
+                    f"Change tracking version {last_version} for {self.table} has expired; "
+                    f"deletes since then cannot be detected. Increase the retention period."
+                )
+            return Delta(True, [], [], [], str(current_version))
+
+        inserted, updated, deleted = [], [], []
+        result = conn.execute(
+            text(
+                f"SELECT CT.{self.key_column}, CT.SYS_CHANGE_OPERATION "
+                f"FROM CHANGETABLE(CHANGES {self.table}, :last_version) AS CT"
+            ),
+            {"last_version": int(last_version)}
+        )
+        for unique_id, operation in result:
+            unique_id = str(unique_id)
+            if operation == 'D':
+                deleted.append(unique_id)
+            elif operation == 'I':
+                inserted.append(unique_id)
+            else:
+                updated.append(unique_id)
+
+        return Delta(False, inserted, updated, deleted, str(current_version))
+
+    def _rowversion_column(self, conn) -> Optional[str]:
+        try:
+            row = conn.execute(
+                text(
+                    "SELECT name FROM sys.columns "
+                    "WHERE object_id = OBJECT_ID(:table) AND system_type_id = 189"  # rowversion/timestamp
+                ),
+                {"table": self.table}
+            ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.debug(f"Rowversion lookup failed for {self.table}: {e}")
+            return None
+
+    def _stage_keys(self, conn):
+        """Key-only scan of the table; deletes are the committed keys missing from it"""
+        result = conn.execution_options(stream_results=True).execute(
+            text(f"SELECT {self.key_column} FROM {self.table}")
+        )
+        reset = True
+        while True:
+            rows = result.fetchmany(self.scan_chunk_size)
+            if not rows:
+                break
+            self.store.stage_keys(self.table, [row[0] for row in rows], reset=reset)
+            reset = False
+        if reset:
+            # Empty table: still clear any stale staging rows
+            self.store.stage_keys(self.table, [], reset=True)
+
+    def _detect_with_rowversion(self, conn, column: str) -> Delta:
+        # Every row below MIN_ACTIVE_ROWVERSION() is committed, so it is a safe exclusive upper bound
+        current = conn.execute(text("SELECT MIN_ACTIVE_ROWVERSION()")).scalar()
+        last = self.store.get_meta(self._watermark_key)
+        self._stage_keys(conn)
+        if last is None or not self.store.has_keys(self.table):
+            return Delta(True, [], [], [], bytes(current).hex())
+
+        result = conn.execute(
+            text(f"SELECT {self.key_column} FROM {self.table} WHERE {column} >= :last AND {column} < :current"),
+            {"last": bytes.fromhex(last), "current": bytes(current)}
+        )
+        return self._key_delta([str(row[0]) for row in result], bytes(current).hex())
+
+    def _detect_with_start_date(self, conn) -> Delta:
+        current = conn.execute(text(f"SELECT MAX({self.date_column}) FROM {self.table}")).scalar()
+        watermark = current.isoformat() if current is not None else ''
+        last = self.store.get_meta(self._watermark_key)
+        self._stage_keys(conn)
+        if last is None or not self.store.has_keys(self.table):
+            return Delta(True, [], [], [], watermark)
+
+        # Breakdowns are edited while they are being closed, so recheck a trailing window
+        query = f"SELECT {self.key_column} FROM {self.table} WHERE {self.date_column} IS NOT NULL"
+        params = {}
+        if last:
+            query += f" AND {self.date_column} >= DATEADD(day, -:days, :last)"
+            params = {"days": self.lookback_days, "last": datetime.fromisoformat(last)}
+        result = conn.execute(text(query), params)
+        return self._key_delta([str(row[0]) for row in result], watermark)
+
+    def _key_delta(self, changed_ids: List[str], watermark: str) -> Delta:
+        """Split high-water changes into inserts and updates using the staged key scan"""
+        inserted, deleted = self.store.diff_keys(self.table)
+        new_ids = set(inserted)
+        updated = [unique_id for unique_id in changed_ids if unique_id not in new_ids]
+        return Delta(False, inserted, updated, deleted, watermark)
+
+    def load_rows(self, unique_ids: List[str]) -> Iterator[pd.DataFrame]:
+        """Fetch full rows for the given IDs in parameter-safe chunks"""
+        query = text(
+            f"SELECT * FROM {self.table} WHERE {self.key_column} IN :ids ORDER BY {self.key_column}"
+        ).bindparams(bindparam("ids", expanding=True))
+
+        with self.engine.connect() as conn:
+            for i in range(0, len(unique_ids), self.id_chunk_size):
+                chunk = unique_ids[i:i + self.id_chunk_size]
+                yield pd.read_sql(query, conn, params={"ids": chunk})
+
+    def commit(self, delta: Delta):
+        """Persist the new baseline once every change in the delta has been applied"""
+        if self._mode == 'change_tracking':
+            self.store.set_meta(self._version_key, delta.watermark)
+        elif self._mode in ('rowversion', 'start_date'):
+            self.store.commit_keys(self.table)
+            self.store.set_meta(self._watermark_key, delta.watermark)
@@ -0,0 +1,247 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model name, sha256(text))
+
+    Vectors live in an append-only float32 file read through np.memmap; a
+    SQLite index maps each text hash to its row in that file.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = 'embedding_cache'):
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.cache_dir, 'vectors.f32')
+        self.lookup_chunk_size = 500
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (text_hash TEXT PRIMARY KEY, row INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+        dim = self._conn.execute("SELECT value FROM cache_meta WHERE key = 'dim'").fetchone()
+        self.dim: Optional[int] = int(dim[0]) if dim else None
+        self._rows = self._row_count()
+        self._matrix: Optional[np.memmap] = None
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _row_count(self) -> int:
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _get_matrix(self, needed_rows: int) -> np.memmap:
+        """Map the vector file, remapping when rows were appended since the last read"""
+        if self._matrix is None or self._matrix.shape[0] < needed_rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                     shape=(self._rows, self.dim))
+        return self._matrix
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return the cached vector for each text, or None on a miss"""
+        hashes = [self.text_hash(text) for text in texts]
+        rows: Dict[str, int] = {}
+        with self._lock:
+            unique_hashes = list(set(hashes))
+            for i in range(0, len(unique_hashes), self.lookup_chunk_size):
+                chunk = unique_hashes[i:i + self.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self._conn.execute(
+                    f"SELECT text_hash, row FROM entries WHERE text_hash IN ({placeholders})", chunk
+                )
+                rows.update(cursor.fetchall())
+
+            matrix = self._get_matrix(max(rows.values()) + 1) if rows else None
+            results = [
+                matrix[rows[h]].tolist() if h in rows else None
+                for h in hashes
+            ]
+
+        found = sum(1 for r in results if r is not None)
+        self.hits += found
+        self.misses += len(results) - found
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        """Append vectors for texts not already cached"""
+        if not texts:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(vectors[0])
+                self._conn.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('dim', ?)", (str(self.dim),))
+
+            new_entries = {}
+            for text, vector in zip(texts, vectors):
+                h = self.text_hash(text)
+                if h not in new_entries:
+                    new_entries[h] = vector
+
+            existing = set()
+            keys = list(new_entries)
+            for i in range(0, len(keys), self.lookup_chunk_size):
+                chunk = keys[i:i + self.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self._conn.execute(
+                    f"SELECT text_hash FROM entries WHERE text_hash IN ({placeholders})", chunk
+                )
+                existing.update(row[0] for row in cursor)
+
+            pending = [(h, v) for h, v in new_entries.items() if h not in existing]
+            if not pending:
+                self._conn.commit()
+                return
+
+            matrix = np.asarray([v for _, v in pending], dtype=np.float32)
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding cache for {self.model_name} holds {self.dim}-d vectors, got {matrix.shape[1]}-d")
+
+            # Vectors are flushed before the index points at them
+            with open(self.vectors_path, 'ab') as f:
+                f.write(matrix.tobytes())
+            first_row = self._rows
+            self._rows += len(pending)
+
+            self._conn.executemany(
+                "INSERT INTO entries (text_hash, row) VALUES (?, ?)",
+                [(h, first_row + j) for j, (h, _) in enumerate(pending)]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(texts)
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(texts[i], []).append(i)
+
+        if missing:
+            missing_texts = list(missing)
+            computed = self.embeddings.embed_documents(missing_texts)
+            self.cache.put_many(missing_texts, computed)
+            for text, vector in zip(missing_texts, computed):
+                for i in missing[text]:
+                    vectors[i] = list(vector)
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+class QueryEmbeddingCache(Embeddings):
+    """Embeddings wrapper with a bounded LRU for query vectors
+
+    Retrievers and the answer cache embed the same questions over and over
+    (follow-ups, retries, example questions). Misses can fall through to an
+    on-disk EmbeddingCache kept apart from document vectors, since some
+    models embed queries with a different prefix.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_entries: int = 2048,
+                 cache_dir: Optional[str] = None):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.disk_cache = EmbeddingCache(f"{model_name}-query", cache_dir) if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, text: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._entries.get(text)
+            if vector is not None:
+                self._entries.move_to_end(text)
+                self.hits += 1
+                return vector
+
+        if self.disk_cache is not None:
+            vector = self.disk_cache.get_many([text])[0]
+            if vector is not None:
+                self._put(text, vector)
+                with self._lock:
+                    self.hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put(self, text: str, vector: List[float]):
+        with self._lock:
+            self._entries[text] = vector
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _remember(self, text: str, vector: List[float]) -> List[float]:
+        vector = list(vector)
+        self._put(text, vector)
+        if self.disk_cache is not None:
+            self.disk_cache.put_many([text], [vector])
+        return vector
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._get(text)
+        if vector is None:
+            vector = self._remember(text, self.embeddings.embed_query(text))
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._get(text)
+        if vector is None:
+            vector = self._remember(text, await self.embeddings.aembed_query(text))
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": size
+        }
@@ -0,0 +1,136 @@
+import logging
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+from langchain_core.documents import Document
+from qdrant_client import QdrantClient, models
+from sqlalchemy import text
+
+from semantic_cache import CollectionVersions
+
+logger = logging.getLogger(__name__)
+
+TEXT_COLUMNS = ['MachineName', 'ProblemType', 'Reason', 'ActualReason', 'details',
+                'ShopName', 'ModuleName', 'LineName', 'Servicetype', 'ClosureReason',
+                'Breakdowntype', 'SubGroup', 'Phenomena', 'Loto', 'Vendor', 'Material']
+
+FRAME_DEFAULTS = {
+    'SapMachnCode': 'UNKNOWN',
+    'MachineName': 'UNKNOWN_MACHINE',
+    'details': '',
+    'ActualReason': 'NO SOLUTION PROVIDED',
+    'Reason': 'NO PROBLEM PROVIDED',
+    'Minutes': 0,
+    'Hours': 0,
+    'ProblemType': 'UNKNOWN',
+    'ClosureReason': 'UNKNOWN',
+    'Vendor': '',
+    'Material': '',
+    'Loto': '',
+    'StartTime': '',
+    'EndTime': ''
+}
+
+
+def point_id(collection_name: str, unique_id: Optional[str]) -> str:
+    """Stable UUIDv5 point ID derived from the collection and Unique_ID_No"""
+    if not unique_id:
+        return str(uuid.uuid4())
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"{collection_name}:{unique_id}"))
+
+
+def clean_text_column(col: pd.Series) -> pd.Series:
+    """Vectorized _clean_text for a whole column"""
+    values = col.astype(str).str.strip()
+    is_empty = col.isna() | values.str.upper().isin(['NULL', 'NAN', 'NONE', ''])
+    return values.mask(is_empty, '')
+
+
+class BreakdownIngestion:
+    """Reading, cleaning and Qdrant bookkeeping shared by preprocessing.py and Embedding_Qdrant.py
+
+    Subclasses set source_table and provide collection_names, batch_size,
+    read_chunk_size, collection_versions_db, _get_sqlalchemy_engine and
+    create_documents. Both scripts derive point IDs here, so a delete from
+    either one hits the points the other wrote.
+    """
+
+    source_table: str
+    text_columns: List[str] = TEXT_COLUMNS
+    frame_defaults: Dict[str, Any] = FRAME_DEFAULTS
+
+    def _qdrant_call(self, operation, *args, **kwargs):
+        """Hook for wrapping Qdrant writes, e.g. in retries"""
+        return operation(*args, **kwargs)
+
+    def load_data(self) -> pd.DataFrame:
+        logger.info("🔄 Loading data from SQL Server...")
+        try:
+            engine = self._get_sqlalchemy_engine()
+            df = pd.read_sql(f"SELECT * FROM {self.source_table}", engine)
+            return self._prepare_frame(df)
+
+        except Exception as e:
+            logger.error(f"Error loading data from SQL Server: {e}")
+            raise
+
+    def load_data_chunks(self) -> Iterator[pd.DataFrame]:
+        """Stream the source table in cleaned chunks"""
+        logger.info("🔄 Streaming data from SQL Server...")
+        try:
+            engine = self._get_sqlalchemy_engine()
+            query = text(f"SELECT * FROM {self.source_table} ORDER BY Unique_ID_No")
+
+            with engine.connect().execution_options(stream_results=True) as conn:
+                for chunk in pd.read_sql(query, conn, chunksize=self.read_chunk_size):
+                    yield self._prepare_frame(chunk)
+
+        except Exception as e:
+            logger.error(f"Error streaming data from SQL Server: {e}")
+            raise
+
+    def _prepare_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Clean text columns and fill defaults on a raw breakdown frame"""
+        for col in self.text_columns:
+            if col in df.columns:
+                df[col] = clean_text_column(df[col])
+
+        df = df.fillna(self.frame_defaults)
+
+        df['Minutes'] = pd.to_numeric(df['Minutes'], errors='coerce').fillna(0).astype(int)
+        df['Hours'] = pd.to_numeric(df['Hours'], errors='coerce').fillna(0).astype(float)
+
+        return df
+
+    def iter_documents(self, chunks: Optional[Iterable[pd.DataFrame]] = None) -> Iterator[Dict[str, List[Document]]]:
+        """Build documents chunk by chunk so only one chunk is in memory at a time"""
+        for chunk in (self.load_data_chunks() if chunks is None else chunks):
+            yield self.create_documents(chunk)
+
+    def _delete_points(self, client: QdrantClient, unique_ids: List[str]):
+        """Remove the points for these Unique_ID_No values from every collection"""
+        existing = {col.name for col in client.get_collections().collections}
+        touched = [name for name in self.collection_names.values() if name in existing]
+        for full_collection_name in touched:
+            for i in range(0, len(unique_ids), self.batch_size):
+                chunk = unique_ids[i:i + self.batch_size]
+                self._qdrant_call(
+                    client.delete,
+                    collection_name=full_collection_name,
+                    points_selector=models.PointIdsList(
+                        points=[point_id(full_collection_name, uid) for uid in chunk]
+                    ),
+                    wait=True
+                )
+        self._bump_collection_versions(touched)
+        logger.info(f"🗑️ Removed {len(unique_ids)} stale breakdowns from Qdrant")
+
+    def _bump_collection_versions(self, full_collection_names: Iterable[str]):
+        """Tell the chat backends' answer caches that these collections changed"""
+        try:
+            versions = CollectionVersions(self.collection_versions_db)
+            for full_collection_name in full_collection_names:
+                versions.bump(full_collection_name)
+        except Exception as e:
+            logger.warning(f"Could not record collection versions: {e}")
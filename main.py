@@ -2,13 +2,11 @@ import logging
 import os
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 from langchain_community.llms import Ollama
 from langchain.chat_models import ChatOpenAI
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_qdrant import QdrantVectorStore
+from rag_chain import build_rag_chain
 from qdrant_client import QdrantClient
 
 # Configure logging
@@ -56,6 +54,8 @@ class MachineBreakdownRAG:
             search_kwargs={"k": 50}
         )
         self.conversation_history = []
+        # Built once; switch_collection only replaces self.retriever, which query() passes in
+        self.rag_chain = self._build_rag_chain()
         
     def _initialize_vector_store(self):
         """Initialize connection to Qdrant vector store based on user role"""
@@ -125,7 +125,7 @@ class MachineBreakdownRAG:
             )
         return "\n\n".join(formatted)
     
-    def _get_rag_chain(self):
+    def _build_rag_chain(self):
         """Create the RAG chain with enhanced prompt for better formatting"""
         template = """You are an expert technician assistant analyzing machine breakdown data. 
         Provide comprehensive, well-structured answers using Markdown formatting with these sections:
@@ -156,23 +156,20 @@ class MachineBreakdownRAG:
         
         **Answer:**"""
         
-        prompt = ChatPromptTemplate.from_template(template)
-        
-        return (
-            {
-                "context": self.retriever | self._format_docs,
-                "question": RunnablePassthrough(),
-                "history": lambda _: "\n".join(self.conversation_history[-3:])  # Last 3 exchanges
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        return build_rag_chain(template, self.llm, self._format_docs)
+
+    def _chain_input(self, question: str) -> Dict[str, Any]:
+        """Inputs for one query: the current collection's retriever and the last three exchanges"""
+        return {
+            "question": question,
+            "history": "\n".join(self.conversation_history[-3:]),
+            "retriever": self.retriever
+        }
     
     def query(self, question: str) -> str:
         """Query the RAG system with a question and maintain conversation history"""
-        rag_chain = self._get_rag_chain()
-        response = rag_chain.invoke(question)
+        chain_input = self._chain_input(question)
+        response = self.rag_chain.invoke(chain_input)
         
         # Update conversation history
         self.conversation_history.append(f"User: {question}")
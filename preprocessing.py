@@ -1,23 +1,30 @@
 import pandas as pd
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OllamaEmbeddings 
 from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient, models
 from qdrant_client.http.exceptions import UnexpectedResponse
 import logging
-from typing import List, Any, Optional, Dict, Tuple
+from typing import List, Any, Optional, Dict, Tuple, Iterable, Iterator
 from datetime import datetime
 import pyodbc
 from sqlalchemy import create_engine
 import urllib.parse
 import os
 import time
-import uuid
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-import csv
 import psutil
 from collections import defaultdict
+from checkpoint_store import CheckpointStore
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from delta_extraction import BreakdownDeltaSource
+from ingestion import BreakdownIngestion, point_id
+from sparse_index import SPARSE_VECTOR_NAME, BM25SparseEncoder, has_sparse_index, sparse_vectors_config
 
 # Configure logging
 logging.basicConfig(
@@ -26,7 +33,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class DataProcessor:
+class DataProcessor(BreakdownIngestion):
+    source_table = 'machine_reports'
+
     def __init__(self, base_path: str = None):
         # SQL Server connection parameters
         self.server = 'JEY_JARVIS'
@@ -39,40 +48,54 @@ class DataProcessor:
             '1250': 'machine_data_1250',
             '1300': 'machine_data_1300'
         }
-        self.progress_file = 'vectorization_progress.csv'
+        self.progress_file = 'vectorization_progress.csv'  # Legacy log, imported once
+        self.progress_db = 'vectorization_progress.db'
+        self.checkpoints: Optional[CheckpointStore] = None
         self.max_retries = 5  # Increased retries
         self.retry_delay = 10  # Increased delay
         self.batch_size = 50  # Reduced batch size
         self.max_memory_usage = 0.85  # 85% memory threshold
+        self.incremental = True  # Upsert into existing collections instead of recreating them
+        self.embed_workers = 2  # Concurrent embedding requests to Ollama
+        self.upload_workers = 2  # Concurrent Qdrant upserts
+        self.max_pending_batches = 4  # Embedded batches allowed to wait for upload
+        self.embedding_model = 'nomic-embed-text'
+        self.use_embedding_cache = True
+        self.embedding_cache_dir = 'embedding_cache'
+        self.collection_versions_db = 'collection_versions.db'  # Read by the chat backends' answer caches
+        self.sparse_encoder = BM25SparseEncoder()  # Lexical index for SAP codes, IDs and error phrases
+        self._sparse_collections: set = set()
+        self.streaming = True  # Stream machine_reports in chunks instead of one DataFrame
+        self.read_chunk_size = 5000  # Rows fetched from SQL Server per chunk
+        self._failed_batches: List[int] = []
         
     def _initialize_progress_log(self):
-        """Initialize or load progress tracking file with headers"""
-        if not os.path.exists(self.progress_file):
-            with open(self.progress_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['Unique_ID_No', 'Collection', 'Processed', 'Timestamp'])
-
-    def _log_processed_id(self, unique_id: str, collection: str):
-        """Log successfully processed IDs with collection info"""
-        with open(self.progress_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([unique_id, collection, True, datetime.now().isoformat()])
-
-    def _get_processed_ids(self) -> Dict[str, set]:
-        """Get dictionary of processed IDs for each collection"""
+        """Open the checkpoint store and import the legacy CSV log once"""
+        checkpoints = self._get_checkpoints()
+        if self.incremental:
+            checkpoints.import_csv(self.progress_file)
+        else:
+            # A full rebuild recreates every collection, so previous checkpoints are void
+            checkpoints.clear()
+
+    def _get_checkpoints(self) -> CheckpointStore:
+        if self.checkpoints is None:
+            self.checkpoints = CheckpointStore(self.progress_db)
+        return self.checkpoints
+
+    def _get_processed_ids(self, df: pd.DataFrame) -> Dict[str, set]:
+        """Look up which of the frame's IDs each collection already holds"""
         processed = defaultdict(set)
-        
-        if os.path.exists(self.progress_file):
-            try:
-                with open(self.progress_file, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row['Processed'].lower() == 'true':
-                            unique_id = row['Unique_ID_No']
-                            collection = row['Collection']
-                            processed[collection].add(unique_id)
-            except Exception as e:
-                logger.warning(f"Error reading progress file: {e}")
+        if 'Unique_ID_No' not in df.columns:
+            return processed
+
+        checkpoints = self._get_checkpoints()
+        unique_ids = df['Unique_ID_No'].astype(str)
+        plants = df['PlantName'].astype(str).str.strip()
+
+        processed['master'] = checkpoints.filter_processed('master', unique_ids)
+        for plant in ['1150', '1200', '1250', '1300']:
+            processed[plant] = checkpoints.filter_processed(plant, unique_ids[plants == plant])
         return processed
         
     def _get_sql_connection(self):
@@ -147,11 +170,38 @@ class DataProcessor:
             logger.warning(f"Could not parse datetime: {e}")
             return {'date': None, 'time': None, 'datetime': None}
 
+    def _format_datetime_column(self, date_col: pd.Series, time_col: pd.Series) -> List[Optional[str]]:
+        """Columnar equivalent of _format_datetime, returning the 'datetime' string per row"""
+        date_obj = date_col.astype(object)
+        time_obj = time_col.astype(object)
+
+        is_datetime = date_obj.map(lambda v: isinstance(v, (pd.Timestamp, datetime)))
+        is_str = date_obj.map(lambda v: isinstance(v, str))
+        is_blank = date_obj.isna() | (date_obj.astype(str).str.strip() == '')
+        has_space = is_str & date_obj.astype(str).str.contains(' ', regex=False)
+        time_is_str = time_obj.map(lambda v: isinstance(v, str)) & (time_obj.astype(str).str.strip() != '')
+
+        parsed = pd.to_datetime(date_obj.where(~is_blank), errors='coerce', format='mixed')
+        time_parsed = pd.to_datetime(time_obj.where(time_is_str), errors='coerce', format='mixed')
+        time_of_day = time_parsed - time_parsed.dt.normalize()
+
+        # Same precedence as _format_datetime: a date-only value is combined with
+        # a string time, everything else is taken as-is
+        combine = ~is_blank & ~is_datetime & ~has_space & time_is_str
+        parsed = parsed.where(~combine, parsed.dt.normalize() + time_of_day)
+
+        formatted = parsed.dt.strftime('%d-%m-%Y %H:%M:%S')
+        return [None if pd.isna(v) else v for v in formatted.tolist()]
+
     def _generate_human_readable_text(self, row: Dict) -> str:
         """Generate the human-readable descriptive text"""
         start_dt = self._format_datetime(row['StartTime'], row['StartTime'])
         end_dt = self._format_datetime(row['EndDate'], row['EndTime'])
-        
+        return self._compose_human_readable_text(row, start_dt['datetime'], end_dt['datetime'])
+
+    def _compose_human_readable_text(self, row: Dict, start_datetime: Optional[str],
+                                     end_datetime: Optional[str]) -> str:
+        """Build the human-readable text from a row and its pre-formatted datetimes"""
         text_parts = [
             f"The machine with Unique ID {row.get('Unique_ID_No', 'UNKNOWN')} had been analyzed.",
             f"The problem type is '{row.get('ProblemType', 'UNKNOWN')}', and it was repaired in Plant {row.get('PlantName', 'UNKNOWN')}, ",
@@ -160,14 +210,14 @@ class DataProcessor:
             f"The SAP machine code is {row.get('SapMachnCode', 'UNKNOWN')}."
         ]
 
-        if start_dt['datetime'] and end_dt['datetime']:
+        if start_datetime and end_datetime:
             text_parts.append(
-                f"The repair started on {start_dt['datetime']} and ended on {end_dt['datetime']}, "
+                f"The repair started on {start_datetime} and ended on {end_datetime}, "
                 f"resulting in a downtime of {row.get('Minutes', 0)} minutes ({row.get('Hours', 0)} hours)."
             )
-        elif start_dt['datetime']:
+        elif start_datetime:
             text_parts.append(
-                f"The repair started on {start_dt['datetime']} with a downtime of {row.get('Minutes', 0)} minutes."
+                f"The repair started on {start_datetime} with a downtime of {row.get('Minutes', 0)} minutes."
             )
         
         text_parts.extend([
@@ -227,48 +277,10 @@ class DataProcessor:
                 time.sleep(wait_time)
         raise last_error
 
-    def load_data(self) -> pd.DataFrame:
-        logger.info("🔄 Loading data from SQL Server...")
-        try:
-            engine = self._get_sqlalchemy_engine()
-            query = "SELECT * FROM machine_reports"
-            df = pd.read_sql(query, engine)
-            
-            text_columns = ['MachineName', 'ProblemType', 'Reason', 'ActualReason', 'details',
-                          'ShopName', 'ModuleName', 'LineName', 'Servicetype', 'ClosureReason',
-                          'Breakdowntype', 'SubGroup', 'Phenomena', 'Loto', 'Vendor', 'Material']
-            
-            for col in text_columns:
-                if col in df.columns:
-                    df[col] = df[col].apply(self._clean_text)
-
-            df = df.fillna({
-                'SapMachnCode': 'UNKNOWN',
-                'MachineName': 'UNKNOWN_MACHINE',
-                'details': '',
-                'ActualReason': 'NO SOLUTION PROVIDED',
-                'Reason': 'NO PROBLEM PROVIDED',
-                'Minutes': 0,
-                'Hours': 0,
-                'ProblemType': 'UNKNOWN',
-                'ClosureReason': 'UNKNOWN',
-                'Vendor': '',
-                'Material': '',
-                'Loto': '',
-                'StartTime': '',
-                'EndTime': ''
-            })
-
-            df['Minutes'] = pd.to_numeric(df['Minutes'], errors='coerce').fillna(0).astype(int)
-            df['Hours'] = pd.to_numeric(df['Hours'], errors='coerce').fillna(0).astype(float)
-
-            return df
-
-        except Exception as e:
-            logger.error(f"Error loading data from SQL Server: {e}")
-            raise
+    def _qdrant_call(self, operation, *args, **kwargs):
+        return self._retry_operation(operation, *args, **kwargs)
 
-    def create_documents(self, df: pd.DataFrame) -> Dict[str, List[Document]]:
+    def create_documents(self, df: pd.DataFrame, columnar: bool = True) -> Dict[str, List[Document]]:
         """Create documents grouped by plant with precise tracking"""
         logger.info("📝 Creating documents...")
         
@@ -276,8 +288,23 @@ class DataProcessor:
         unique_plants = df['PlantName'].unique()
         logger.info(f"Unique plant values in data: {unique_plants}")
         
+        # A full rebuild recreates every collection, so nothing counts as processed
+        processed_ids = self._get_processed_ids(df) if self.incremental else defaultdict(set)
+        if columnar:
+            documents, new_documents_count = self._create_documents_columnar(df, processed_ids)
+        else:
+            documents, new_documents_count = self._create_documents_rowwise(df, processed_ids)
+
+        plant_counts = {k: len(v) for k, v in documents.items()}
+        logger.info(f"New documents to process by plant: {plant_counts}")
+        logger.info(f"Total new documents to process: {new_documents_count}")
+
+        return documents
+
+    def _create_documents_rowwise(self, df: pd.DataFrame,
+                                  processed_ids: Dict[str, set]) -> Tuple[Dict[str, List[Document]], int]:
+        """Build documents one row at a time with iterrows"""
         documents = defaultdict(list)
-        processed_ids = self._get_processed_ids()
         new_documents_count = 0
 
         for _, row in tqdm(df.iterrows(), total=len(df), desc="Processing rows"):
@@ -287,103 +314,19 @@ class DataProcessor:
                     continue
                 
                 plant = str(row['PlantName']).strip()
-                machine_name = row.get('MachineName', 'UNKNOWN_MACHINE')
-                sap_code = row.get('SapMachnCode', 'UNKNOWN')
-                machine_id = f"{machine_name}_{sap_code}"
-                
                 needs_master = unique_id not in processed_ids['master']
                 needs_plant = (plant in ['1150', '1200', '1250', '1300'] and 
                             unique_id not in processed_ids[plant])
                 
                 if not needs_master and not needs_plant:
                     continue
-                    
-                human_readable_text = self._generate_human_readable_text(row)
-
-                structured_text_parts = [
-                    "MACHINE DETAILS:",
-                    f"Name: {machine_name}",
-                    f"SAP Code: {sap_code}",
-                    f"Plant: {row.get('PlantName', 'UNKNOWN')}",
-                    f"Shop: {row['ShopName']}",
-                    f"Module: {row['ModuleName']}",
-                    f"Line: {row['LineName']}",
-                    f"Sub Group: {row['SubGroup']}",
-                    "",
-                    "BREAKDOWN DETAILS:",
-                    f"Problem Type: {row['ProblemType']}",
-                    f"Service Type: {row['Servicetype']}",
-                    f"Start Time: {self._format_datetime(row['StartTime'], row['StartTime'])['datetime'] or 'UNKNOWN'}",
-                    f"End Time: {self._format_datetime(row['EndDate'], row['EndTime'])['datetime'] or 'UNKNOWN'}",
-                    f"Duration: {row['Minutes']} minutes ({row['Hours']} hours)",
-                    "",
-                    "ISSUE DETAILS:",
-                    f"Problem: {row['Reason']}",
-                    f"Solution: {row['ActualReason']}",
-                    f"Phenomena: {row['Phenomena']}",
-                    f"Details: {row['details']}",
-                    "",
-                    "STATUS INFORMATION:",
-                    f"Closure Reason: {row['ClosureReason']}",
-                    f"Breakdown Type: {row['Breakdowntype']}",
-                    f"SAP Status: {row.get('SapStatus', 'UNKNOWN')}",
-                    f"LOTO: {row['Loto']}",
-                    "",
-                    "ADDITIONAL INFO:",
-                    f"Vendor: {row['Vendor']}",
-                    f"Material: {row['Material']}"
-                ]
-
-                structured_text = "\n".join(
-                    part for part in structured_text_parts 
-                    if not (part.endswith(": ") or 
-                        (part.endswith(":") and len(part.split(':')) == 1 or
-                        part.endswith(": UNKNOWN") or
-                        part.endswith(": NO DETAILS PROVIDED") or
-                        part.endswith(": NO SOLUTION PROVIDED"))
-                ))
-
-                metadata = {
-                    "machine_id": machine_id,
-                    "machine_name": machine_name,
-                    "sap_code": sap_code,
-                    "plant": str(row.get('PlantName', 'UNKNOWN')),
-                    "shop": row['ShopName'],
-                    "module": row['ModuleName'],
-                    "line": row['LineName'],
-                    "problem_type": row['ProblemType'],
-                    "service_type": row['Servicetype'],
-                    "shift": row['ShiftName'],
-                    "duration_minutes": int(row['Minutes']),
-                    "duration_hours": float(row['Hours']),
-                    "start_time": self._format_datetime(row['StartDate'], row['StartTime'])['datetime'],
-                    "end_time": self._format_datetime(row['EndDate'], row['EndTime'])['datetime'],
-                    "problem": row['Reason'],
-                    "solution": row['ActualReason'],
-                    "details": row['details'],
-                    "closure_reason": row['ClosureReason'],
-                    "breakdown_type": row['Breakdowntype'],
-                    "sap_status": row.get('SapStatus', 'UNKNOWN'),
-                    "sub_group": row['SubGroup'],
-                    "phenomena": row['Phenomena'],
-                    "loto": row['Loto'],
-                    "vendor": row['Vendor'],
-                    "material": row['Material'],
-                    "unique_id": unique_id,
-                    "human_readable_text": human_readable_text,
-                    "full_text": structured_text
-                }
-
-                metadata = {
-                    k: v for k, v in metadata.items()
-                    if v not in ['', 'UNKNOWN', 'NO DETAILS PROVIDED',
-                            'NO SOLUTION PROVIDED', 'NO PROBLEM PROVIDED',
-                            'NAN', 'NULL', 'NONE'] and v is not None
-                }
-
-                doc = Document(
-                    page_content=human_readable_text,
-                    metadata=metadata
+
+                doc = self._build_document(
+                    row,
+                    unique_id,
+                    self._format_datetime(row['StartTime'], row['StartTime'])['datetime'],
+                    self._format_datetime(row['StartDate'], row['StartTime'])['datetime'],
+                    self._format_datetime(row['EndDate'], row['EndTime'])['datetime']
                 )
 
                 if needs_master:
@@ -398,21 +341,186 @@ class DataProcessor:
                 logger.error(f"Error processing row {row.get('Unique_ID_No', 'UNKNOWN')}: {e}")
                 continue
 
-        plant_counts = {k: len(v) for k, v in documents.items()}
-        logger.info(f"New documents to process by plant: {plant_counts}")
-        logger.info(f"Total new documents to process: {new_documents_count}")
+        return documents, new_documents_count
 
-        return documents
+    def _create_documents_columnar(self, df: pd.DataFrame,
+                                   processed_ids: Dict[str, set]) -> Tuple[Dict[str, List[Document]], int]:
+        """Build documents from column arrays, parsing each datetime column once"""
+        documents = defaultdict(list)
+        new_documents_count = 0
+
+        if 'Unique_ID_No' in df.columns:
+            unique_ids = df['Unique_ID_No'].astype(str)
+        else:
+            unique_ids = pd.Series('', index=df.index)
+        plants = df['PlantName'].astype(str).str.strip()
+
+        needs_master = ~unique_ids.isin(processed_ids['master'])
+        needs_plant = pd.Series(False, index=df.index)
+        for plant in ['1150', '1200', '1250', '1300']:
+            in_plant = plants == plant
+            needs_plant |= in_plant & ~unique_ids.isin(processed_ids[plant])
+
+        selected = (unique_ids != '') & (needs_master | needs_plant)
+        subset = df[selected]
+        if subset.empty:
+            return documents, new_documents_count
+
+        # Each pair is parsed once for the whole column instead of per row
+        text_start_times = self._format_datetime_column(subset['StartTime'], subset['StartTime'])
+        start_times = self._format_datetime_column(subset['StartDate'], subset['StartTime'])
+        end_times = self._format_datetime_column(subset['EndDate'], subset['EndTime'])
+
+        records = subset.to_dict('records')
+        rows = zip(
+            records,
+            unique_ids[selected].tolist(),
+            plants[selected].tolist(),
+            needs_master[selected].tolist(),
+            needs_plant[selected].tolist(),
+            text_start_times,
+            start_times,
+            end_times
+        )
+
+        for row, unique_id, plant, row_needs_master, row_needs_plant, text_start, start, end in tqdm(
+                rows, total=len(records), desc="Processing rows"):
+            try:
+                doc = self._build_document(row, unique_id, text_start, start, end)
+
+                if row_needs_master:
+                    documents['master'].append(doc)
+                    new_documents_count += 1
+
+                if row_needs_plant:
+                    documents[plant].append(doc)
+                    new_documents_count += 1
+
+            except Exception as e:
+                logger.error(f"Error processing row {row.get('Unique_ID_No', 'UNKNOWN')}: {e}")
+                continue
+
+        return documents, new_documents_count
+
+    def _build_document(self, row: Dict, unique_id: str, text_start_time: Optional[str],
+                        start_time: Optional[str], end_time: Optional[str]) -> Document:
+        """Build a single Document from a row and its pre-formatted datetimes"""
+        machine_name = row.get('MachineName', 'UNKNOWN_MACHINE')
+        sap_code = row.get('SapMachnCode', 'UNKNOWN')
+        machine_id = f"{machine_name}_{sap_code}"
+
+        human_readable_text = self._compose_human_readable_text(row, text_start_time, end_time)
+
+        structured_text_parts = [
+            "MACHINE DETAILS:",
+            f"Name: {machine_name}",
+            f"SAP Code: {sap_code}",
+            f"Plant: {row.get('PlantName', 'UNKNOWN')}",
+            f"Shop: {row['ShopName']}",
+            f"Module: {row['ModuleName']}",
+            f"Line: {row['LineName']}",
+            f"Sub Group: {row['SubGroup']}",
+            "",
+            "BREAKDOWN DETAILS:",
+            f"Problem Type: {row['ProblemType']}",
+            f"Service Type: {row['Servicetype']}",
+            f"Start Time: {text_start_time or 'UNKNOWN'}",
+            f"End Time: {end_time or 'UNKNOWN'}",
+            f"Duration: {row['Minutes']} minutes ({row['Hours']} hours)",
+            "",
+            "ISSUE DETAILS:",
+            f"Problem: {row['Reason']}",
+            f"Solution: {row['ActualReason']}",
+            f"Phenomena: {row['Phenomena']}",
+            f"Details: {row['details']}",
+            "",
+            "STATUS INFORMATION:",
+            f"Closure Reason: {row['ClosureReason']}",
+            f"Breakdown Type: {row['Breakdowntype']}",
+            f"SAP Status: {row.get('SapStatus', 'UNKNOWN')}",
+            f"LOTO: {row['Loto']}",
+            "",
+            "ADDITIONAL INFO:",
+            f"Vendor: {row['Vendor']}",
+            f"Material: {row['Material']}"
+        ]
+
+        structured_text = "\n".join(
+            part for part in structured_text_parts 
+            if not (part.endswith(": ") or 
+                (part.endswith(":") and len(part.split(':')) == 1 or
+                part.endswith(": UNKNOWN") or
+                part.endswith(": NO DETAILS PROVIDED") or
+                part.endswith(": NO SOLUTION PROVIDED"))
+        ))
+
+        metadata = {
+            "machine_id": machine_id,
+            "machine_name": machine_name,
+            "sap_code": sap_code,
+            "plant": str(row.get('PlantName', 'UNKNOWN')),
+            "shop": row['ShopName'],
+            "module": row['ModuleName'],
+            "line": row['LineName'],
+            "problem_type": row['ProblemType'],
+            "service_type": row['Servicetype'],
+            "shift": row['ShiftName'],
+            "duration_minutes": int(row['Minutes']),
+            "duration_hours": float(row['Hours']),
+            "start_time": start_time,
+            "end_time": end_time,
+            "problem": row['Reason'],
+            "solution": row['ActualReason'],
+            "details": row['details'],
+            "closure_reason": row['ClosureReason'],
+            "breakdown_type": row['Breakdowntype'],
+            "sap_status": row.get('SapStatus', 'UNKNOWN'),
+            "sub_group": row['SubGroup'],
+            "phenomena": row['Phenomena'],
+            "loto": row['Loto'],
+            "vendor": row['Vendor'],
+            "material": row['Material'],
+            "unique_id": unique_id,
+            "human_readable_text": human_readable_text,
+            "full_text": structured_text
+        }
+
+        metadata = {
+            k: v for k, v in metadata.items()
+            if v not in ['', 'UNKNOWN', 'NO DETAILS PROVIDED',
+                    'NO SOLUTION PROVIDED', 'NO PROBLEM PROVIDED',
+                    'NAN', 'NULL', 'NONE'] and v is not None
+        }
+
+        return Document(
+            page_content=human_readable_text,
+            metadata=metadata
+        )
     
     def _initialize_qdrant_collection(self, client: QdrantClient, collection_name: str, vector_size: int):
-        """Initialize Qdrant collection with optimized settings"""
+        """Create the Qdrant collection if missing, otherwise validate it for incremental upserts"""
         try:
-            # First check if collection exists
-            try:
-                client.get_collection(collection_name)
+            existing_collections = client.get_collections()
+            collection_exists = any(
+                col.name == collection_name
+                for col in existing_collections.collections
+            )
+
+            if collection_exists and self.incremental:
+                self._validate_qdrant_collection(client, collection_name, vector_size)
+                if has_sparse_index(client, collection_name):
+                    self._sparse_collections.add(collection_name)
+                else:
+                    logger.warning(
+                        f"{collection_name} has no BM25 sparse index; writing dense vectors only. "
+                        f"Set incremental=False to rebuild it for hybrid search."
+                    )
+                logger.info(f"Reusing existing collection {collection_name} for incremental upsert")
+                return
+
+            if collection_exists:
                 client.delete_collection(collection_name)
-            except Exception:
-                pass  # Collection doesn't exist
+                logger.info(f"Dropped collection {collection_name} for full rebuild")
 
             vector_config = models.VectorParams(
                 size=vector_size,
@@ -424,6 +532,7 @@ class DataProcessor:
             client.create_collection(
                 collection_name=collection_name,
                 vectors_config=vector_config,
+                sparse_vectors_config=sparse_vectors_config(),
                 optimizers_config=models.OptimizersConfigDiff(
                     indexing_threshold=20000,
                     memmap_threshold=10000,
@@ -432,97 +541,281 @@ class DataProcessor:
                 ),
                 shard_number=2
             )
+            self._sparse_collections.add(collection_name)
             
             logger.info(f"Created collection {collection_name} with optimized settings")
         except Exception as e:
             logger.error(f"Error initializing collection {collection_name}: {e}")
             raise
 
-    def create_vector_stores(self, documents: Dict[str, List[Document]]):
-        """Create vector stores with optimized batch processing"""
-        logger.info("🧠 Creating vector stores...")
+    def _validate_qdrant_collection(self, client: QdrantClient, collection_name: str, vector_size: int):
+        """Ensure an existing collection matches the embedding size and distance"""
+        info = client.get_collection(collection_name)
+        vectors = info.config.params.vectors
+        if isinstance(vectors, dict):
+            raise ValueError(
+                f"Collection {collection_name} uses named vectors {list(vectors)}; "
+                f"expected a single unnamed vector"
+            )
 
-        # Initialize embeddings and client
-        embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        client = QdrantClient(
+        if vectors.size != vector_size:
+            raise ValueError(
+                f"Collection {collection_name} has vector size {vectors.size}, "
+                f"but the embedding model produces {vector_size}. Set incremental=False to rebuild."
+            )
+        if vectors.distance != models.Distance.COSINE:
+            raise ValueError(
+                f"Collection {collection_name} uses {vectors.distance} distance, expected COSINE. "
+                f"Set incremental=False to rebuild."
+            )
+
+    def _get_embeddings(self) -> Embeddings:
+        embeddings = OllamaEmbeddings(model=self.embedding_model)
+        if self.use_embedding_cache:
+            # Unchanged texts are read back from disk instead of re-embedded
+            embeddings = CachedEmbeddings(embeddings, EmbeddingCache(self.embedding_model, self.embedding_cache_dir))
+        return embeddings
+
+    def _get_qdrant_client(self) -> QdrantClient:
+        return QdrantClient(
             host="localhost",
             port=6333,
             prefer_grpc=True,
             timeout=120
         )
 
+    def create_vector_stores(self, documents: Dict[str, List[Document]], pipelined: bool = True):
+        """Create vector stores, embedding each unique document once for all its collections"""
+        self.create_vector_stores_streaming([documents], pipelined=pipelined)
+
+    def create_vector_stores_streaming(self, document_chunks: Iterable[Dict[str, List[Document]]],
+                                       pipelined: bool = True) -> set:
+        """Embed and upsert document chunks as they are produced; returns collections that could not be set up"""
+        logger.info("🧠 Creating vector stores...")
+
+        # Initialize embeddings and client
+        embeddings = self._get_embeddings()
+        client = self._get_qdrant_client()
+
         # First get embedding dimension
         sample_embedding = embeddings.embed_query("test")
         vector_size = len(sample_embedding)
 
+        ready_collections = set()
+        failed_collections = set()
+        for documents in document_chunks:
+            for collection_name, docs in documents.items():
+                if not docs or collection_name in ready_collections or collection_name in failed_collections:
+                    continue
+                    
+                try:
+                    full_collection_name = self.collection_names[collection_name]
+                    self._initialize_qdrant_collection(client, full_collection_name, vector_size)
+                    ready_collections.add(collection_name)
+                except Exception as e:
+                    failed_collections.add(collection_name)
+                    logger.error(f"❌ Failed to update collection {collection_name}: {str(e)}", exc_info=True)
+                    continue
+
+            items = self._group_document_targets(documents, ready_collections)
+            if not items:
+                continue
+            logger.info(
+                f"Embedding {len(items)} unique documents for "
+                f"{sum(len(targets) for _, targets in items)} collection writes"
+            )
+
+            if pipelined:
+                self._process_documents_pipelined(embeddings, client, items)
+            else:
+                self._process_documents_serial(embeddings, client, items)
+
+        for collection_name in sorted(ready_collections):
+            logger.info(f"✅ Successfully updated {self.collection_names[collection_name]}")
+        self._bump_collection_versions(self.collection_names[name] for name in ready_collections)
+        return failed_collections
+
+    def _group_document_targets(self, documents: Dict[str, List[Document]],
+                                collections: set) -> List[Tuple[Document, List[str]]]:
+        """Collapse the per-collection lists into unique documents with their target collections"""
+        grouped: Dict[Any, Tuple[Document, List[str]]] = {}
         for collection_name, docs in documents.items():
-            if not docs:
+            if collection_name not in collections:
                 continue
-                
+            for doc in docs:
+                key = doc.metadata.get('unique_id') or id(doc)
+                _, targets = grouped.setdefault(key, (doc, []))
+                if collection_name not in targets:
+                    targets.append(collection_name)
+        return list(grouped.values())
+
+    def _upsert_batch(self, client: QdrantClient, batch: List[Tuple[Document, List[str]]],
+                      vectors: List[List[float]]):
+        """Write one embedded batch to every target collection and checkpoint it"""
+        points_by_collection = defaultdict(list)
+        for (doc, targets), vector in zip(batch, vectors):
+            sparse = self.sparse_encoder.encode_document(doc.page_content)
+            for collection_name in targets:
+                points_by_collection[collection_name].append((doc, vector, sparse))
+
+        for collection_name, entries in points_by_collection.items():
+            full_collection_name = self.collection_names[collection_name]
+
+            # Deterministic IDs so re-runs overwrite points in place
+            points = [
+                models.PointStruct(
+                    id=point_id(full_collection_name, doc.metadata.get('unique_id')),
+                    vector=(
+                        {"": vector, SPARSE_VECTOR_NAME: sparse}
+                        if full_collection_name in self._sparse_collections else vector
+                    ),
+                    # Payload layout matches what QdrantVectorStore reads back
+                    payload={
+                        QdrantVectorStore.CONTENT_KEY: doc.page_content,
+                        QdrantVectorStore.METADATA_KEY: doc.metadata
+                    }
+                )
+                for doc, vector, sparse in entries
+            ]
+
+            # Upload with retry
+            self._retry_operation(
+                client.upsert,
+                collection_name=full_collection_name,
+                points=points,
+                wait=True
+            )
+
+            # Checkpoint the whole batch in one transaction
+            self._get_checkpoints().mark_processed(
+                collection_name,
+                [doc.metadata.get('unique_id') for doc, _, _ in entries]
+            )
+
+    def _process_documents_serial(self, embeddings: Embeddings, client: QdrantClient,
+                                  items: List[Tuple[Document, List[str]]]):
+        """Embed and upsert one batch at a time"""
+        for i in tqdm(range(0, len(items), self.batch_size), 
+                    desc="Processing documents"):
+            batch = items[i:i + self.batch_size]
+            
             try:
-                full_collection_name = self.collection_names[collection_name]
-                self._initialize_qdrant_collection(client, full_collection_name, vector_size)
+                # Generate embeddings for the batch
+                texts = [doc.page_content for doc, _ in batch]
+                embeddings_list = self._retry_operation(
+                    embeddings.embed_documents,
+                    texts
+                )
+                self._upsert_batch(client, batch, embeddings_list)
                 
-                # Process documents in optimized batches
-                for i in tqdm(range(0, len(docs), self.batch_size), 
-                            desc=f"Processing {full_collection_name}"):
-                    batch = docs[i:i + self.batch_size]
-                    
-                    try:
-                        # Generate embeddings for the batch
-                        texts = [doc.page_content for doc in batch]
-                        embeddings_list = self._retry_operation(
-                            embeddings.embed_documents,
-                            texts
-                        )
-                        
-                        # Create points with unique IDs
-                        points = [
-                            models.PointStruct(
-                                id=str(uuid.uuid4()),  # Generate proper UUIDs
-                                vector=embeddings_list[j],
-                                payload=doc.metadata
-                            )
-                            for j, doc in enumerate(batch)
-                        ]
-                        
-                        # Upload with retry
-                        self._retry_operation(
-                            client.upsert,
-                            collection_name=full_collection_name,
-                            points=points,
-                            wait=True
-                        )
-                        
-                        # Log successful processing
-                        for doc in batch:
-                            unique_id = doc.metadata.get('unique_id')
-                            if unique_id:
-                                self._log_processed_id(unique_id, collection_name)
-                        
-                        # Small delay between batches
-                        time.sleep(1)
-                        
-                    except Exception as e:
-                        logger.error(f"Failed to process batch starting at {i} for {full_collection_name}: {e}")
-                        continue
+                # Small delay between batches
+                time.sleep(1)
                 
-                logger.info(f"✅ Successfully updated {full_collection_name}")
-
             except Exception as e:
-                logger.error(f"❌ Failed to update collection {collection_name}: {str(e)}", exc_info=True)
+                self._failed_batches.append(i)
+                logger.error(f"Failed to process batch starting at {i}: {e}")
                 continue
 
+    def _process_documents_pipelined(self, embeddings: Embeddings, client: QdrantClient,
+                                     items: List[Tuple[Document, List[str]]]):
+        """Overlap embedding and upserting through a bounded queue"""
+        starts = range(0, len(items), self.batch_size)
+        # Embedded batches waiting for upload; a full queue blocks the embedding workers
+        upload_queue = queue.Queue(maxsize=self.max_pending_batches)
+        progress = tqdm(total=len(starts), desc="Processing documents")
+
+        def embed_batch(start: int):
+            batch = items[start:start + self.batch_size]
+            try:
+                texts = [doc.page_content for doc, _ in batch]
+                vectors = self._retry_operation(embeddings.embed_documents, texts)
+            except Exception as e:
+                self._failed_batches.append(start)
+                logger.error(f"Failed to embed batch starting at {start}: {e}")
+                progress.update(1)
+                return
+            upload_queue.put((start, batch, vectors))
+
+        def upload_worker():
+            while True:
+                item = upload_queue.get()
+                if item is None:
+                    break
+                start, batch, vectors = item
+                try:
+                    self._upsert_batch(client, batch, vectors)
+                except Exception as e:
+                    self._failed_batches.append(start)
+                    logger.error(f"Failed to upsert batch starting at {start}: {e}")
+                finally:
+                    progress.update(1)
+
+        uploaders = [
+            threading.Thread(target=upload_worker, name=f"qdrant-upload-{n}", daemon=True)
+            for n in range(self.upload_workers)
+        ]
+        for uploader in uploaders:
+            uploader.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.embed_workers) as executor:
+                list(executor.map(embed_batch, starts))
+        finally:
+            for _ in uploaders:
+                upload_queue.put(None)
+            for uploader in uploaders:
+                uploader.join()
+            progress.close()
+
     def run(self):
         try:
             self._initialize_progress_log()
-            df = self.load_data()
-            documents = self.create_documents(df)
-            self.create_vector_stores(documents)
+            if self.streaming:
+                self._run_streaming()
+            else:
+                df = self.load_data()
+                documents = self.create_documents(df)
+                self.create_vector_stores(documents)
             logger.info("🚀 Vectorization process completed successfully")
         except Exception as e:
             logger.error(f"💥 Error in processing: {str(e)}", exc_info=True)
             raise
+        finally:
+            if self.checkpoints is not None:
+                self.checkpoints.close()
+                self.checkpoints = None
+
+    def _run_streaming(self):
+        """Stream only the rows inserted or changed since the last clean run"""
+        checkpoints = self._get_checkpoints()
+        source = BreakdownDeltaSource(self._get_sqlalchemy_engine(), 'machine_reports', checkpoints)
+        # Always scan so a full rebuild still records the baseline for the next run
+        delta = source.detect_changes()
+        self._failed_batches = []
+        failed_collections = set()
+
+        if delta.full_reload or not self.incremental:
+            failed_collections = self.create_vector_stores_streaming(self.iter_documents())
+        else:
+            stale_ids = delta.updated_ids + delta.deleted_ids
+            if stale_ids:
+                # Edited rows are re-embedded below; deleted rows just disappear
+                self._delete_points(self._get_qdrant_client(), stale_ids)
+                checkpoints.remove(stale_ids)
+            if delta.changed_ids:
+                chunks = (self._prepare_frame(chunk) for chunk in source.load_rows(delta.changed_ids))
+                failed_collections = self.create_vector_stores_streaming(self.iter_documents(chunks))
+            else:
+                logger.info("No new or changed breakdowns since the last run")
+
+        # Only move the baseline once everything was written; failed rows are retried next run
+        if failed_collections:
+            logger.warning(f"Collections failed for {sorted(failed_collections)}; keeping the previous delta baseline")
+        elif self._failed_batches:
+            logger.warning(f"{len(self._failed_batches)} batches failed; keeping the previous delta baseline")
+        else:
+            source.commit(delta)
+
 
 if __name__ == "__main__":
     logger.info("🚀 Starting preprocessing pipeline")
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.retrievers import BaseRetriever
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import AsyncQdrantClient, QdrantClient
+
+from async_retrieval import AsyncQdrantRetriever
+from reranker import CrossEncoderReranker, RerankingRetriever
+from sparse_index import BM25SparseEncoder, has_sparse_index
+
+logger = logging.getLogger(__name__)
+
+
+class RetrieverPool:
+    """Per-plant vector stores and retrievers, prepared at startup and reused by every request
+
+    Subclasses open a collection's store and build its base retriever. With a
+    reranker the base over-fetches rerank_candidates and the cross-encoder
+    chooses the records the LLM sees; without one it returns k records.
+    Opening a store does network or disk I/O, so async callers use aget.
+    """
+
+    def __init__(self, collection_names: Dict[str, str], k: int,
+                 reranker: Optional[CrossEncoderReranker] = None, rerank_candidates: int = 100):
+        self.collection_names = collection_names
+        self.k = k
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.vector_stores: Dict[str, Any] = {}
+        self.retrievers: Dict[str, BaseRetriever] = {}
+        self._lock = threading.Lock()
+        self.prepare_all()
+
+    def _open_store(self, collection_name: str):
+        raise NotImplementedError
+
+    def _base_retriever(self, vector_store, k: int) -> BaseRetriever:
+        raise NotImplementedError
+
+    def prepare_all(self):
+        for role in self.collection_names:
+            try:
+                self.get(role)
+            except Exception as e:
+                # Retried on first use, e.g. once the collection has been ingested
+                logger.warning(f"Could not prepare retriever for {role}: {str(e)}")
+
+    def get(self, role: str) -> Tuple[Any, BaseRetriever]:
+        """Return the pooled (vector_store, retriever) pair for a role"""
+        with self._lock:
+            if role not in self.retrievers:
+                vector_store = self._open_store(self.collection_names.get(role, 'machine_data_master'))
+                retriever = self._base_retriever(vector_store, self.rerank_candidates if self.reranker else self.k)
+                if self.reranker:
+                    retriever = RerankingRetriever(base=retriever, reranker=self.reranker)
+                self.vector_stores[role] = vector_store
+                self.retrievers[role] = retriever
+            return self.vector_stores[role], self.retrievers[role]
+
+    async def aget(self, role: str) -> Tuple[Any, BaseRetriever]:
+        """get() for async callers; a store not prepared at startup is opened in a worker thread"""
+        if role in self.retrievers:
+            return self.vector_stores[role], self.retrievers[role]
+        return await asyncio.to_thread(self.get, role)
+
+
+class QdrantRetrieverPool(RetrieverPool):
+    """RetrieverPool over the machine_data_* Qdrant collections
+
+    One long-lived client pair serves every plant: the sync client for
+    startup and invoke, the async one for the chat endpoints. Collections
+    ingested with the BM25 sparse index get dense + sparse search fused
+    with RRF.
+    """
+
+    def __init__(self, collection_names: Dict[str, str], embeddings, k: int,
+                 reranker: Optional[CrossEncoderReranker] = None, rerank_candidates: int = 100,
+                 host: str = 'localhost', port: int = 6333, timeout: int = 30):
+        self.embeddings = embeddings
+        self.client = QdrantClient(host=host, port=port, timeout=timeout)
+        self.async_client = AsyncQdrantClient(host=host, port=port, timeout=timeout)
+        self.sparse_encoder = BM25SparseEncoder()
+        super().__init__(collection_names, k, reranker, rerank_candidates)
+
+    def _open_store(self, collection_name: str) -> QdrantVectorStore:
+        return QdrantVectorStore(
+            client=self.client,
+            collection_name=collection_name,
+            embedding=self.embeddings
+        )
+
+    def _base_retriever(self, vector_store: QdrantVectorStore, k: int) -> AsyncQdrantRetriever:
+        collection_name = vector_store.collection_name
+        return AsyncQdrantRetriever(
+            client=self.client,
+            async_client=self.async_client,
+            collection_name=collection_name,
+            embeddings=self.embeddings,
+            k=k,
+            sparse_encoder=self.sparse_encoder if has_sparse_index(self.client, collection_name) else None
+        )
+
+    async def verify_connection(self) -> Tuple[bool, str]:
+        try:
+            await self.async_client.get_collections()
+            return True, "Connected to Qdrant and vector store is ready"
+        except Exception as e:
+            return False, f"Connection error: {str(e)}"
+
+
+def cache_metrics(embeddings, answer_cache=None) -> Dict[str, Dict[str, float]]:
+    """Hit/miss counters reported on /api/health"""
+    metrics = {"query_embeddings": embeddings.stats()}
+    if answer_cache is not None:
+        metrics["answers"] = answer_cache.stats()
+    return metrics
+
+
+def sse_event(data: Dict, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Event; JSON keeps the markdown newlines inside a single data line"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
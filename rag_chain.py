@@ -0,0 +1,44 @@
+from typing import Any, Callable, Dict, List
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableLambda, RunnablePassthrough
+
+
+def build_rag_chain(template: str, llm, format_docs: Callable[..., str], reserve_prompt: bool = False,
+                    **extra_inputs: Callable[[Dict[str, Any]], Any]) -> Runnable:
+    """Compile the retrieve -> prompt -> LLM chain once per process
+
+    The chain takes {"question": str, "history": str, "retriever": BaseRetriever}
+    so a single compiled chain serves every plant collection and session.
+    An optional "question_vector" (already computed for the answer cache) is
+    handed to the retriever so the question is not embedded twice.
+    With reserve_prompt, format_docs also gets the template, question and
+    history as reserved_text, so a token-budgeted builder leaves room for them.
+    extra_inputs are computed per call (e.g. the current time).
+    """
+    def search_kwargs(inputs: Dict[str, Any]) -> Dict[str, Any]:
+        vector = inputs.get("question_vector")
+        return {} if vector is None else {"vector": vector}
+
+    def context(inputs: Dict[str, Any], docs: List[Document]) -> str:
+        if reserve_prompt:
+            return format_docs(docs, reserved_text="\n".join([template, inputs["question"], inputs.get("history", "")]))
+        return format_docs(docs)
+
+    def retrieve(inputs: Dict[str, Any]) -> str:
+        return context(inputs, inputs["retriever"].invoke(inputs["question"], **search_kwargs(inputs)))
+
+    async def aretrieve(inputs: Dict[str, Any]) -> str:
+        return context(inputs, await inputs["retriever"].ainvoke(inputs["question"], **search_kwargs(inputs)))
+
+    return (
+        RunnablePassthrough.assign(
+            context=RunnableLambda(retrieve, afunc=aretrieve),
+            **extra_inputs
+        )
+        | ChatPromptTemplate.from_template(template)
+        | llm
+        | StrOutputParser()
+    )
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class ChatSession:
+    """Per-user chat state: the plant collection to search and the recent conversation"""
+
+    def __init__(self, session_id: str, role: str, max_history: int = 6):
+        self.session_id = session_id
+        self.role = role
+        self.max_history = max_history
+        self.history: List[str] = []
+        self.last_access = time.monotonic()
+        self._lock = threading.Lock()
+
+    def recent_history(self, turns: int = 3) -> str:
+        with self._lock:
+            return "\n".join(self.history[-turns:]) if self.history else "No history"
+
+    def add_turn(self, question: str, answer: str):
+        with self._lock:
+            self.history.append(f"User: {question}")
+            self.history.append(f"Assistant: {answer}")
+            # Keep history manageable
+            if len(self.history) > self.max_history:
+                self.history = self.history[-self.max_history:]
+
+
+class SessionStore:
+    """Bounded in-process LRU of chat sessions with idle-time expiry
+
+    Each uvicorn worker holds its own store, so a session's history only
+    follows the user while requests land on the same worker.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 1800):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, role: str) -> ChatSession:
+        """Return the live session for session_id, starting a fresh one if it expired or changed plant"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            session = self._sessions.get(session_id)
+            if session is None or session.role != role:
+                session = ChatSession(session_id, role)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.last_access = now
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def drop(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def _evict_expired(self, now: float):
+        # Least recently used sessions sit at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_access < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Scores (question, record) pairs with a small CPU cross-encoder and keeps the best top_n
+
+    Pairs are scored in batches in retrieval order. Once latency_budget_ms is
+    spent, the remaining candidates keep their dense-retrieval order behind
+    the scored ones. Scores are cached per (question, record).
+    """
+
+    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2', top_n: int = 10,
+                 batch_size: int = 32, latency_budget_ms: float = 300, cache_size: int = 8192,
+                 device: str = 'cpu'):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device=device)
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.latency_budget_ms = latency_budget_ms
+        self.cache_size = cache_size
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _doc_key(doc: Document) -> str:
+        return doc.metadata.get('unique_id') or hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+
+    def _cached_scores(self, query: str, keys: List[str]) -> Dict[str, float]:
+        with self._lock:
+            found = {}
+            for key in keys:
+                score = self._scores.get((query, key))
+                if score is not None:
+                    self._scores.move_to_end((query, key))
+                    found[key] = score
+            return found
+
+    def _remember(self, query: str, scored: Dict[str, float]):
+        with self._lock:
+            for key, score in scored.items():
+                self._scores[(query, key)] = score
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query: str, docs: List[Document]) -> List[Document]:
+        if not docs:
+            return []
+        start = time.perf_counter()
+        keys = [self._doc_key(doc) for doc in docs]
+        scores = self._cached_scores(query, keys)
+
+        pending = [i for i, key in enumerate(keys) if key not in scores]
+        new_scores = {}
+        for b in range(0, len(pending), self.batch_size):
+            if b and (time.perf_counter() - start) * 1000 > self.latency_budget_ms:
+                logger.info(f"Rerank budget of {self.latency_budget_ms} ms spent; "
+                            f"{len(pending) - b} candidates keep their dense order")
+                break
+            batch = pending[b:b + self.batch_size]
+            predictions = self.model.predict([(query, docs[i].page_content) for i in batch])
+            for i, score in zip(batch, predictions):
+                new_scores[keys[i]] = float(score)
+        self._remember(query, new_scores)
+        scores.update(new_scores)
+
+        scored = sorted((i for i in range(len(docs)) if keys[i] in scores),
+                        key=lambda i: scores[keys[i]], reverse=True)
+        unscored = [i for i in range(len(docs)) if keys[i] not in scores]
+
+        reranked = []
+        for i in (scored + unscored)[:self.top_n]:
+            doc = docs[i]
+            metadata = dict(doc.metadata)
+            if keys[i] in scores:
+                metadata['rerank_score'] = round(scores[keys[i]], 4)
+            reranked.append(Document(page_content=doc.page_content, metadata=metadata))
+
+        logger.info(f"🔀 Reranked {len(docs)} candidates to {len(reranked)} "
+                    f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return reranked
+
+
+def load_reranker(**kwargs) -> Optional[CrossEncoderReranker]:
+    """Build the reranker, or return None so callers fall back to plain similarity search"""
+    try:
+        return CrossEncoderReranker(**kwargs)
+    except ImportError:
+        logger.warning("sentence-transformers is not installed; reranking disabled")
+    except Exception as e:
+        logger.warning(f"Could not load reranker model: {e}; reranking disabled")
+    return None
+
+
+class RerankingRetriever(BaseRetriever):
+    """Over-fetches from a base retriever and keeps the reranker's top_n
+
+    Extra invoke kwargs (e.g. a precomputed query vector) go to the base.
+    """
+
+    base: BaseRetriever
+    reranker: CrossEncoderReranker
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun, **kwargs) -> List[Document]:
+        return self.reranker.rerank(query, self.base.invoke(query, **kwargs))
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun, **kwargs) -> List[Document]:
+        docs = await self.base.ainvoke(query, **kwargs)
+        # Cross-encoder scoring is CPU-bound; keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self.reranker.rerank, query, docs)
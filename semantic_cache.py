@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionVersions:
+    """Per-collection version counters shared between the ingestion jobs and the API processes"""
+
+    def __init__(self, db_path: str = 'collection_versions.db'):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS collection_versions (
+                    collection TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Short-lived connections; several processes read and write this file
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def bump(self, collection: str):
+        """Record that ingestion changed a collection"""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO collection_versions (collection, version, updated_at) VALUES (?, 1, ?)
+                ON CONFLICT(collection) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+                """,
+                (collection, datetime.now().isoformat())
+            )
+
+    def get(self, collection: str) -> int:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT version FROM collection_versions WHERE collection = ?", (collection,)
+            ).fetchone()
+        return row[0] if row else 0
+
+
+class _CachedAnswer:
+    __slots__ = ('question', 'vector', 'answer', 'context', 'created_at')
+
+    def __init__(self, question: str, vector: np.ndarray, answer: str, context: bytes):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.context = context
+        self.created_at = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """LRU+TTL cache of answers keyed by collection and question embedding
+
+    A lookup hits when a cached question in the same collection has cosine
+    similarity of at least similarity_threshold with the new one and was
+    answered with the same context (the conversation history in the prompt),
+    so a follow-up never gets an answer written for another conversation. A
+    collection's entries are dropped when its ingestion version changes.
+    The version check reads SQLite, so async callers use alookup/astore.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 500,
+                 ttl_seconds: float = 3600, versions: Optional[CollectionVersions] = None,
+                 version_check_interval: float = 30):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries  # Per collection
+        self.ttl_seconds = ttl_seconds
+        self.versions = versions
+        self.version_check_interval = version_check_interval
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: Dict[str, "OrderedDict[int, _CachedAnswer]"] = {}
+        self._known_versions: Dict[str, int] = {}
+        self._last_version_check: Dict[str, float] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    @staticmethod
+    def _context_key(context: str) -> bytes:
+        return hashlib.sha256(context.encode('utf-8')).digest()
+
+    def _check_version(self, collection: str, now: float):
+        """Drop a collection's answers once ingestion has written to it"""
+        if self.versions is None or now - self._last_version_check.get(collection, float('-inf')) < self.version_check_interval:
+            return
+        self._last_version_check[collection] = now
+        try:
+            version = self.versions.get(collection)
+        except Exception as e:
+            logger.warning(f"Could not read collection version for {collection}: {e}")
+            return
+        if self._known_versions.get(collection) != version:
+            if collection in self._known_versions:
+                logger.info(f"{collection} was re-ingested; dropping its cached answers")
+            self._entries.pop(collection, None)
+            self._known_versions[collection] = version
+
+    def lookup(self, collection: str, vector: List[float], context: str = '') -> Optional[str]:
+        now = time.monotonic()
+        query = self._normalize(vector)
+        context_key = self._context_key(context)
+        with self._lock:
+            self._check_version(collection, now)
+            entries = self._entries.get(collection)
+            best_id, best_score = None, self.similarity_threshold
+            if entries:
+                for entry_id, entry in list(entries.items()):
+                    if now - entry.created_at >= self.ttl_seconds:
+                        del entries[entry_id]
+                        continue
+                    if entry.context != context_key:
+                        continue
+                    score = float(np.dot(query, entry.vector))
+                    if score >= best_score:
+                        best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(best_id)
+            self.hits += 1
+            return entries[best_id].answer
+
+    def store(self, collection: str, question: str, vector: List[float], answer: str, context: str = ''):
+        with self._lock:
+            self._check_version(collection, time.monotonic())
+            entries = self._entries.setdefault(collection, OrderedDict())
+            entries[self._next_id] = _CachedAnswer(question, self._normalize(vector), answer, self._context_key(context))
+            self._next_id += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    async def alookup(self, collection: str, vector: List[float], context: str = '') -> Optional[str]:
+        return await asyncio.to_thread(self.lookup, collection, vector, context)
+
+    async def astore(self, collection: str, question: str, vector: List[float], answer: str, context: str = ''):
+        await asyncio.to_thread(self.store, collection, question, vector, answer, context)
+
+    def invalidate(self, collection: Optional[str] = None):
+        """Drop cached answers for one collection, or all of them"""
+        with self._lock:
+            if collection is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(collection, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            size = sum(len(entries) for entries in self._entries.values())
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": size
+        }
@@ -0,0 +1,70 @@
+import re
+import zlib
+from collections import Counter
+from typing import List
+
+from qdrant_client import QdrantClient, models
+
+# Named sparse vector stored next to the unnamed dense vector in every collection
+SPARSE_VECTOR_NAME = 'bm25'
+
+# Codes such as "M-1150/03" are kept whole and also split into their parts
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_/.][a-z0-9]+)*")
+PART_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in TOKEN_PATTERN.findall(str(text).lower()):
+        tokens.append(match)
+        if not match.isalnum():
+            tokens.extend(PART_PATTERN.findall(match))
+    return tokens
+
+
+def _token_index(token: str) -> int:
+    return zlib.crc32(token.encode('utf-8')) & 0x7fffffff
+
+
+def sparse_vectors_config() -> dict:
+    """Sparse vector config for new collections; Qdrant applies the IDF part of BM25"""
+    return {SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)}
+
+
+def has_sparse_index(client: QdrantClient, collection_name: str) -> bool:
+    """Whether a collection was built with the BM25 sparse vector"""
+    sparse = client.get_collection(collection_name).config.params.sparse_vectors or {}
+    return SPARSE_VECTOR_NAME in sparse
+
+
+class BM25SparseEncoder:
+    """Client-side BM25 term weights for Qdrant sparse vectors
+
+    Documents get the saturated, length-normalised term frequency part of
+    BM25; queries get 1.0 per distinct term. The collection's IDF modifier
+    supplies the inverse document frequency at search time.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_doc_length: float = 150):
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = avg_doc_length
+
+    def _to_vector(self, weights: dict) -> models.SparseVector:
+        # Merge the rare crc32 collisions so indices stay unique
+        merged = Counter()
+        for token, weight in weights.items():
+            merged[_token_index(token)] += weight
+        return models.SparseVector(indices=list(merged), values=[float(v) for v in merged.values()])
+
+    def encode_document(self, text: str) -> models.SparseVector:
+        tokens = tokenize(text)
+        norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avg_doc_length)
+        weights = {
+            token: tf * (self.k1 + 1) / (tf + norm)
+            for token, tf in Counter(tokens).items()
+        }
+        return self._to_vector(weights)
+
+    def encode_query(self, text: str) -> models.SparseVector:
+        return self._to_vector({token: 1.0 for token in tokenize(text)})
@@ -1,12 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
 import pyodbc
-from typing import List, Optional , Union
-from datetime import datetime, time
+import asyncio
+import base64
+import csv
+import io
+import json
+import tempfile
+import logging
+import queue
+import threading
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from decimal import Decimal
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional , Union, Literal, Tuple
+from datetime import date, datetime, time, timedelta
 from pydantic import BaseModel , validator
 from typing import Optional, Union
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db_config.start()
+    yield
+    db_config.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -15,8 +37,99 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Content-Disposition"],  # Keyset cursor; export file name
 )
 
+DATABASE_MAPPING = {
+    'master': 'MachineBreakdownDB',
+    '1150': 'MachineBreakdown_1150',
+    '1200': 'MachineBreakdown_1200',
+    '1250': 'MachineBreakdown_1250',
+    '1300': 'MachineBreakdown_1300'
+}
+
+class ConnectionPool:
+    """Bounded pool of pyodbc connections to one database
+
+    Idle connections are reused most-recent first. A connection that has
+    been idle longer than health_check_after seconds is pinged before it is
+    handed out, and dropped if the ping fails.
+    """
+    def __init__(self, connect, max_size: int = 5, checkout_timeout: float = 30,
+                 health_check_after: float = 30):
+        self._connect = connect
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        try:
+            conn.cursor().execute("SELECT 1").fetchone()
+            return True
+        except pyodbc.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise TimeoutError(f"No database connection free within {self.checkout_timeout}s")
+        try:
+            while True:
+                try:
+                    conn, released_at = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if clock.monotonic() - released_at < self.health_check_after or self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False):
+        try:
+            if broken:
+                self._discard(conn)
+                return
+            try:
+                conn.rollback()  # End the read transaction before reuse
+                self._idle.put((conn, clock.monotonic()))
+            except pyodbc.Error:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except pyodbc.Error:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
 class DatabaseConfig:
     def __init__(self):
         self.server = 'JEY_JARVIS'
@@ -25,28 +138,150 @@ class DatabaseConfig:
             '{SQL Server Native Client 11.0}',
             '{SQL Server}'  # Fallback to older drivers if needed
         ]
+        self.driver: Optional[str] = None  # First driver that connected; tried first from then on
+        self.login_timeout = 10
+        self.pool_size = 5  # Per plant database
+        self.checkout_timeout = 30
+        self.pools: Dict[str, ConnectionPool] = {}
+        # Free connections per database, awaited on the event loop before any work reaches the executor
+        self.slots: Dict[str, asyncio.Semaphore] = {}
+        # Threads running blocking pyodbc calls; None means one per pooled connection plus a few spare
+        self.query_workers: Optional[int] = None
+        self.query_timeout = 60  # Seconds, enforced by the driver and by the endpoint
+        self.disconnect_poll_interval = 0.5
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
     
     def get_connection(self, database_name):
-        for driver in self.drivers:
+        drivers = [self.driver] + [d for d in self.drivers if d != self.driver] if self.driver else self.drivers
+        for driver in drivers:
             try:
                 conn_str = f'DRIVER={driver};SERVER={self.server};DATABASE={database_name};Trusted_Connection=yes;'
-                return pyodbc.connect(conn_str)
+                conn = pyodbc.connect(conn_str, timeout=self.login_timeout)
+                self.driver = driver
+                return conn
             except pyodbc.Error:
                 continue
         raise Exception("Could not connect with any available driver")
 
+    def get_pool(self, database_name: str) -> ConnectionPool:
+        with self._lock:
+            if database_name not in self.pools:
+                self.pools[database_name] = ConnectionPool(
+                    lambda: self.get_connection(database_name), max_size=self.pool_size,
+                    checkout_timeout=self.checkout_timeout
+                )
+                self.slots[database_name] = asyncio.Semaphore(self.pool_size)
+            return self.pools[database_name]
+
+    async def wait_for_slot(self, plant: str) -> asyncio.Semaphore:
+        """Wait until the plant's pool has a free connection, without tying up an executor thread"""
+        database_name = DATABASE_MAPPING.get(plant, 'MachineBreakdownDB')
+        self.get_pool(database_name)
+        slot = self.slots[database_name]
+        try:
+            await asyncio.wait_for(slot.acquire(), timeout=self.checkout_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail=f"No database connection free within {self.checkout_timeout}s")
+        return slot
+
+    def start(self):
+        """Build every plant's pool and find a working driver with one warm connection"""
+        # Every slot holder gets a thread at once, so one busy plant cannot starve the others
+        workers = self.query_workers or self.pool_size * len(DATABASE_MAPPING) + 4
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='breakdown-db')
+        for database_name in DATABASE_MAPPING.values():
+            self.get_pool(database_name)
+        master = self.get_pool(DATABASE_MAPPING['master'])
+        try:
+            master.release(master.acquire())
+            logger.info(f"Connected to {self.server} with {self.driver}")
+        except Exception as e:
+            logger.warning(f"Could not open a warm connection to {self.server}: {e}")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        for pool in self.pools.values():
+            pool.close()
+
 db_config = DatabaseConfig()
 
 def get_db_connection(plant: str):
-    database_mapping = {
-        'master': 'MachineBreakdownDB',
-        '1150': 'MachineBreakdown_1150',
-        '1200': 'MachineBreakdown_1200',
-        '1250': 'MachineBreakdown_1250',
-        '1300': 'MachineBreakdown_1300'
-    }
-    database_name = database_mapping.get(plant, 'MachineBreakdownDB')
-    return db_config.get_connection(database_name)
+    """Pooled connection for a plant's database, returned to the pool when the with-block exits"""
+    database_name = DATABASE_MAPPING.get(plant, 'MachineBreakdownDB')
+    return db_config.get_pool(database_name).connection()
+
+class QueryCancelled(Exception):
+    pass
+
+class QueryHandle:
+    """Lets the event loop cancel a query running on the DB executor"""
+    def __init__(self):
+        self.cursor = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def open_cursor(self, conn):
+        conn.timeout = db_config.query_timeout  # Driver-side query timeout
+        cursor = conn.cursor()
+        # Publishing the cursor and checking for cancel happen together, so a
+        # cancel() either sees the cursor or is seen here
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelled()
+            self.cursor = cursor
+        return cursor
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            cursor = self.cursor
+        if cursor is not None:
+            try:
+                cursor.cancel()
+            except pyodbc.Error:
+                pass
+
+async def run_db(request: Request, plant: str, func: Callable, *args):
+    """Run func(handle, plant, *args) on the DB executor without blocking the event loop
+
+    Work is only submitted once the plant's pool has a free connection. The
+    query is cancelled if the client disconnects or query_timeout passes.
+    """
+    slot = await db_config.wait_for_slot(plant)
+    handle = QueryHandle()
+    loop = asyncio.get_running_loop()
+    try:
+        future = loop.run_in_executor(db_config.executor, func, handle, plant, *args)
+    except BaseException:
+        slot.release()
+        raise
+    # Held until the worker has handed its connection back to the pool
+    future.add_done_callback(lambda f: slot.release())
+    deadline = loop.time() + db_config.query_timeout
+
+    def abandon():
+        handle.cancel()
+        # The worker still finishes, usually with the driver's cancel error; nobody reads it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            done, _ = await asyncio.wait({future}, timeout=max(0, min(db_config.disconnect_poll_interval, remaining)))
+            if done:
+                return future.result()
+            if await request.is_disconnected():
+                abandon()
+                logger.info(f"Client disconnected; cancelled query for {request.url.path}")
+                raise HTTPException(status_code=499, detail="Client disconnected")
+            if loop.time() >= deadline:
+                abandon()
+                raise HTTPException(status_code=504, detail=f"Query exceeded {db_config.query_timeout}s")
+    except asyncio.CancelledError:
+        abandon()
+        raise
 
 class BreakdownRecord(BaseModel):
     Unique_ID_No: Union[str, int, float]
@@ -90,61 +325,419 @@ class BreakdownRecord(BaseModel):
             time: lambda v: v.isoformat() if v else None
         }
 
-@app.get("/api/breakdown-data/", response_model=List[BreakdownRecord])
-@app.get("/api/breakdown-data/{plant}", response_model=List[BreakdownRecord])
-async def get_breakdown_data(plant: str = None):
-    try:
-        conn = get_db_connection(plant)
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
+class BreakdownFilters(BaseModel):
+    """Query-string filters shared by the breakdown-data endpoints"""
+    machine: Optional[str] = None
+    shift: Optional[str] = None
+    module: Optional[str] = None
+    shop: Optional[str] = None
+    line: Optional[str] = None
+    start_date: Optional[date] = None  # Inclusive
+    end_date: Optional[date] = None    # Inclusive
+
+FILTER_COLUMNS = {
+    'machine': 'MachineName',
+    'shift': 'ShiftName',
+    'module': 'ModuleName',
+    'shop': 'ShopName',
+    'line': 'LineName'
+}
+
+SELECT_COLUMNS = """
             Unique_ID_No, Type_id, ProblemType, PlantName, ShopName, 
             ModuleName, LineName, MachineName, Servicetype, SapMachnCode,
             ShiftName, StartDate, StartTime, EndDate, EndTime, Minutes, 
             Hours, ClosureReason, ActualReason, Breakdowntype, SapStatus,
-            SubGroup, Phenomena, Loto, Vendor, Material, Reason, details
+            SubGroup, Phenomena, Loto, Vendor, Material, Reason, details"""
+
+COLUMNS = [column.strip() for column in SELECT_COLUMNS.split(',')]
+
+MAX_PAGE_SIZE = 5000
+STREAM_CHUNK_SIZE = 2000  # Rows per fetchmany in the streaming endpoints
+
+def encode_cursor(start_date, unique_id) -> str:
+    if isinstance(unique_id, (Decimal, float)):
+        unique_id = int(unique_id)
+    payload = json.dumps([start_date.isoformat() if start_date else None, unique_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], Union[str, int]]:
+    try:
+        start_date, unique_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(start_date) if start_date else None), unique_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_clause(order: str, start_date: Optional[datetime], unique_id) -> Tuple[str, list]:
+    """Rows strictly after the cursor in (StartDate, Unique_ID_No) order"""
+    # SQL Server sorts NULL StartDates first ascending and last descending
+    if order == 'desc':
+        if start_date is None:
+            return "(StartDate IS NULL AND Unique_ID_No < ?)", [unique_id]
+        return ("(StartDate < ? OR (StartDate = ? AND Unique_ID_No < ?) OR StartDate IS NULL)",
+                [start_date, start_date, unique_id])
+    if start_date is None:
+        return "(StartDate IS NOT NULL OR Unique_ID_No > ?)", [unique_id]
+    return "(StartDate > ? OR (StartDate = ? AND Unique_ID_No > ?))", [start_date, start_date, unique_id]
+
+def build_breakdown_query(filters: BreakdownFilters, order: str = 'desc', limit: Optional[int] = None,
+                          cursor: Optional[str] = None) -> Tuple[str, list]:
+    """Parameterized SELECT for the filters, sort order and keyset page"""
+    clauses, params = [], []
+    for field, column in FILTER_COLUMNS.items():
+        value = getattr(filters, field)
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if filters.start_date:
+        clauses.append("StartDate >= ?")
+        params.append(filters.start_date)
+    if filters.end_date:
+        clauses.append("StartDate < ?")
+        params.append(filters.end_date + timedelta(days=1))
+    if cursor:
+        clause, cursor_params = keyset_clause(order, *decode_cursor(cursor))
+        clauses.append(clause)
+        params.extend(cursor_params)
+
+    direction = 'ASC' if order == 'asc' else 'DESC'
+    top = "TOP (?)" if limit else ""
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    query = f"""
+        SELECT {top}{SELECT_COLUMNS}
         FROM MachineBreakdowns
-        ORDER BY StartDate DESC
+        {where}
+        ORDER BY StartDate {direction}, Unique_ID_No {direction}
         """
+    return query, ([limit] if limit else []) + params
+
+def row_to_dict(columns: List[str], row) -> dict:
+    row_dict = {}
+    for col, val in zip(columns, row):
+        # Handle NULL values first
+        if val is None:
+            row_dict[col] = "" if col not in ['Minutes', 'Hours'] else 0
+            continue
         
-        cursor.execute(query)
+        # Special handling for numeric fields
+        if col in ['Minutes', 'Hours']:
+            row_dict[col] = int(val) if val is not None else 0
+        # Convert datetime to ISO format string
+        elif isinstance(val, datetime):
+            row_dict[col] = val.isoformat()
+        # Convert time to string
+        elif isinstance(val, time):
+            row_dict[col] = val.strftime('%H:%M:%S')
+        # Convert numeric IDs to strings
+        elif col in ['Unique_ID_No', 'Type_id', 'PlantName', 'SapMachnCode']:
+            row_dict[col] = str(int(val)) if val is not None else ""
+        # Convert all other values to string
+        else:
+            row_dict[col] = str(val) if val is not None else ""
+    return row_dict
+
+def fetch_page(handle: QueryHandle, plant: str, query: str, params: list,
+               limit: Optional[int]) -> Tuple[List[dict], Optional[str]]:
+    """Blocking part of get_breakdown_data; runs on the DB executor"""
+    with get_db_connection(plant) as conn:
+        cursor = handle.open_cursor(conn)
+        cursor.execute(query, params)
         columns = [column[0] for column in cursor.description]
-        results = []
-        
-        for row in cursor.fetchall():
-            row_dict = {}
-            for col, val in zip(columns, row):
-                # Handle NULL values first
-                if val is None:
-                    row_dict[col] = "" if col not in ['Minutes', 'Hours'] else 0
-                    continue
-                
-                # Special handling for numeric fields
-                if col in ['Minutes', 'Hours']:
-                    row_dict[col] = int(val) if val is not None else 0
-                # Convert datetime to ISO format string
-                elif isinstance(val, datetime):
-                    row_dict[col] = val.isoformat()
-                # Convert time to string
-                elif isinstance(val, time):
-                    row_dict[col] = val.strftime('%H:%M:%S')
-                # Convert numeric IDs to strings
-                elif col in ['Unique_ID_No', 'Type_id', 'PlantName', 'SapMachnCode']:
-                    row_dict[col] = str(int(val)) if val is not None else ""
-                # Convert all other values to string
-                else:
-                    row_dict[col] = str(val) if val is not None else ""
-            
-            results.append(row_dict)
-        
-        return results
+        rows = cursor.fetchall()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[columns.index('StartDate')], last[columns.index('Unique_ID_No')])
+    return [row_to_dict(columns, row) for row in rows], next_cursor
+
+@app.get("/api/breakdown-data/", response_model=List[BreakdownRecord])
+@app.get("/api/breakdown-data/{plant}", response_model=List[BreakdownRecord])
+async def get_breakdown_data(request: Request, response: Response, plant: str = None,
+                             filters: BreakdownFilters = Depends(),
+                             limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                             page_cursor: Optional[str] = Query(None, alias='cursor'),
+                             order: Literal['asc', 'desc'] = 'desc'):
+    """Breakdowns newest first (or oldest with order=asc)
+
+    Without limit the full filtered history is returned. With limit one page
+    is returned, and the X-Next-Cursor header carries the cursor for the
+    next page. It is omitted on the last page.
+    """
+    query, params = build_breakdown_query(filters, order, limit + 1 if limit else None, page_cursor)
+    try:
+        records, next_cursor = await run_db(request, plant, fetch_page, query, params, limit)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return records
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+def _execute(handle: QueryHandle, conn, query: str, params: list) -> List[str]:
+    cursor = handle.open_cursor(conn)
+    cursor.execute(query, params)
+    return [column[0] for column in cursor.description]
+
+def _fetch_rendered(handle: QueryHandle, columns: List[str], render: Callable, chunk_size: int) -> Optional[bytes]:
+    if handle.cancelled:
+        raise QueryCancelled()
+    rows = handle.cursor.fetchmany(chunk_size)
+    return render(columns, rows) if rows else None
+
+async def stream_query(plant: str, query: str, params: list, render: Callable[[List[str], list], bytes],
+                       chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield render(columns, rows) per fetchmany chunk, with every pyodbc call on the DB executor
+
+    The pooled connection is held until the result set is exhausted. If the
+    stream is closed early (e.g. the client disconnected), the query is
+    cancelled and the connection is dropped once the worker lets go of it.
+    """
+    loop = asyncio.get_running_loop()
+    slot = await db_config.wait_for_slot(plant)
+    pool = db_config.get_pool(DATABASE_MAPPING.get(plant, 'MachineBreakdownDB'))
+    pending = loop.run_in_executor(db_config.executor, pool.acquire)
+    try:
+        conn = await asyncio.shield(pending)
+    except asyncio.CancelledError:
+        def give_back(f):
+            if not f.cancelled() and f.exception() is None:
+                pool.release(f.result())
+            slot.release()
+
+        pending.add_done_callback(give_back)
+        raise
+    except BaseException:
+        slot.release()
+        raise
+
+    handle = QueryHandle()
+    exhausted = False
+    try:
+        pending = loop.run_in_executor(db_config.executor, _execute, handle, conn, query, params)
+        columns = await asyncio.shield(pending)
+        while True:
+            pending = loop.run_in_executor(db_config.executor, _fetch_rendered, handle, columns, render, chunk_size)
+            chunk = await asyncio.shield(pending)
+            if chunk is None:
+                exhausted = True
+                return
+            yield chunk
     finally:
-        if 'conn' in locals():
-            conn.close()
+        if not exhausted:
+            handle.cancel()
+        def release(_=None):
+            returned = db_config.executor.submit(pool.release, conn, not exhausted)
+            returned.add_done_callback(lambda _: loop.call_soon_threadsafe(slot.release))
+
+        if pending.done():
+            release()
+        else:
+            pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+            pending.add_done_callback(release)
+
+async def prime_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Run a stream up to its first chunk so connection and query errors surface before headers are sent"""
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def body():
+        if first is not None:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+    return body()
+
+def render_ndjson(columns: List[str], rows: list) -> bytes:
+    return "".join(json.dumps(row_to_dict(columns, row)) + "\n" for row in rows).encode()
+
+def render_json_items(columns: List[str], rows: list) -> bytes:
+    return ",".join(json.dumps(row_to_dict(columns, row)) for row in rows).encode()
+
+async def json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield b"["
+    first = True
+    async for chunk in chunks:
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
+
+@app.get("/api/breakdown-data-stream/")
+@app.get("/api/breakdown-data-stream/{plant}")
+async def stream_breakdown_data(plant: str = None, filters: BreakdownFilters = Depends(),
+                                order: Literal['asc', 'desc'] = 'desc',
+                                fmt: Literal['ndjson', 'json'] = Query('ndjson', alias='format')):
+    """The full filtered result set as NDJSON (default) or one JSON array, streamed in chunks
+
+    Rows are serialized straight from the cursor, without building the
+    result list or BreakdownRecord models.
+    """
+    query, params = build_breakdown_query(filters, order)
+    render = render_ndjson if fmt == 'ndjson' else render_json_items
+    try:
+        chunks = await prime_stream(stream_query(plant, query, params, render))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if fmt == 'json':
+        return StreamingResponse(json_array(chunks), media_type="application/json")
+    return StreamingResponse(chunks, media_type="application/x-ndjson")
+
+class CsvRenderer:
+    def __init__(self):
+        self.header_written = False
+
+    def _header(self, writer):
+        writer.writerow(COLUMNS)
+        self.header_written = True
+
+    def __call__(self, columns: List[str], rows: list) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not self.header_written:
+            self._header(writer)
+        writer.writerows(row_to_dict(columns, row).values() for row in rows)
+        return buffer.getvalue().encode('utf-8')
+
+    def finish(self) -> Iterator[bytes]:
+        if not self.header_written:  # Empty result: header only
+            buffer = io.StringIO()
+            self._header(csv.writer(buffer))
+            yield buffer.getvalue().encode('utf-8')
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+class ParquetRenderer:
+    """One Parquet row group per fetched chunk, sent as soon as it is written"""
+    def __init__(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            (column, pa.int64() if column in ('Minutes', 'Hours') else pa.string())
+            for column in COLUMNS
+        ])
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression='snappy')
+
+    def __call__(self, columns: List[str], rows: list) -> bytes:
+        records = [row_to_dict(columns, row) for row in rows]
+        self.writer.write_table(self.pa.Table.from_pylist(records, schema=self.schema))
+        return self.sink.drain()
+
+    def finish(self) -> Iterator[bytes]:
+        self.writer.close()  # Writes the footer
+        yield self.sink.drain()
+
+class XlsxRenderer:
+    """Write-only openpyxl workbook; rows go to openpyxl's temp file, not memory
+
+    XLSX is a zip with a trailing directory, so the file is sent once all
+    rows are written, read back from a temporary file in 1 MB blocks.
+    """
+    def __init__(self):
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        self.illegal_characters = ILLEGAL_CHARACTERS_RE
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("BreakdownData")
+        self.sheet.append(COLUMNS)
+
+    def __call__(self, columns: List[str], rows: list) -> bytes:
+        for row in rows:
+            self.sheet.append([
+                self.illegal_characters.sub('', value) if isinstance(value, str) else value
+                for value in row_to_dict(columns, row).values()
+            ])
+        return b""
+
+    def finish(self) -> Iterator[bytes]:
+        with tempfile.TemporaryFile() as file:
+            self.workbook.save(file)
+            file.seek(0)
+            while True:
+                block = file.read(1024 * 1024)
+                if not block:
+                    return
+                yield block
+
+EXPORT_FORMATS = {
+    'csv': (CsvRenderer, 'text/csv; charset=utf-8'),
+    'parquet': (ParquetRenderer, 'application/vnd.apache.parquet'),
+    'xlsx': (XlsxRenderer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+}
+
+async def with_tail(chunks: AsyncIterator[bytes], finish: Callable[[], Iterator[bytes]]) -> AsyncIterator[bytes]:
+    """Body chunks followed by the renderer's closing bytes, all produced on the DB executor"""
+    async for chunk in chunks:
+        if chunk:
+            yield chunk
+    loop = asyncio.get_running_loop()
+    tail = await loop.run_in_executor(db_config.executor, finish)
+    while True:
+        block = await loop.run_in_executor(db_config.executor, next, tail, None)
+        if block is None:
+            return
+        if block:
+            yield block
+
+@app.get("/api/breakdown-data-export/")
+@app.get("/api/breakdown-data-export/{plant}")
+async def export_breakdown_data(plant: str = None, filters: BreakdownFilters = Depends(),
+                                order: Literal['asc', 'desc'] = 'desc',
+                                fmt: Literal['csv', 'parquet', 'xlsx'] = Query('csv', alias='format')):
+    """Download the filtered breakdowns as CSV, Parquet or XLSX, built server-side from chunked reads"""
+    renderer_class, media_type = EXPORT_FORMATS[fmt]
+    try:
+        renderer = renderer_class()
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=f"{fmt} export is not available on this server: {e}")
+
+    query, params = build_breakdown_query(filters, order)
+    try:
+        chunks = await prime_stream(stream_query(plant, query, params, renderer))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    plant_label = plant if plant in DATABASE_MAPPING else 'master'
+    filename = f"BreakdownData_{plant_label}_{date.today().isoformat()}.{fmt}"
+    return StreamingResponse(
+        with_tail(chunks, renderer.finish),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 if __name__ == "__main__":
     import uvicorn